@@ -0,0 +1,21 @@
+"""Run the benchmark suite against the stored baseline.
+
+    python benchmarks/run.py [rows]
+    python benchmarks/run.py [rows] --save   # refresh baseline.json
+
+Same as `python -m sqlfile /tmp/bench.sqlite bench --baseline ...`"""
+import sys
+import tempfile
+from pathlib import Path
+from sqlfile import bench
+
+
+if __name__ == '__main__':
+    baseline = Path(__file__).with_name('baseline.json')
+    args = [a for a in sys.argv[1:] if a != '--save']
+    rows = int(args[0]) if args else 50000
+    save = '--save' in sys.argv
+    with tempfile.TemporaryDirectory() as tmp:
+        sys.exit(bench.main(str(Path(tmp) / 'bench.sqlite'), rows=rows,
+                            baseline=None if save else baseline,
+                            save_baseline=baseline if save else None))
@@ -1,6 +1,9 @@
+import json
+import sys
 import logging
 import argparse
 from sqlfile import Sq
+from sqlfile import bench
 
 
 log = logging.getLogger()
@@ -9,16 +12,45 @@ log = logging.getLogger()
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
 
-    parser.add_argument('sql_path', help='sqlite db file')
-    parser.add_argument('action', choices=['load', 'counts'])
+    parser.add_argument('sql_path', help='sqlite db file (bench: a scratch '
+                                         'file, must not exist)')
+    parser.add_argument('action', choices=['load', 'counts', 'profile',
+                                           'export', 'merge', 'bench'])
 
-    parser.add_argument('-i', dest='input_file', required=False, default=None)
+    parser.add_argument('-i', dest='input_file', required=False, default=None,
+                        help="csv file, optionally gz/bz2/xz, '-' for stdin")
+    parser.add_argument('-o', dest='output_file', required=False,
+                        default=None)
     parser.add_argument('-t', dest='table', required=False, default=None)
+    parser.add_argument('-q', dest='query', required=False, default=None,
+                        help='export: SELECT query instead of a table')
     parser.add_argument('--no-header', default=False)
     parser.add_argument('--log-level', default='INFO')
     parser.add_argument('--replace-db', action='store_true',
                         help='replace sqlite db file')
     parser.add_argument('--append', action='store_true')
+    parser.add_argument('--approx', action='store_true',
+                        help='estimate counts of untracked tables')
+    parser.add_argument('--format', choices=['csv', 'jsonl'], default=None,
+                        help='export format, by default from -o suffix')
+    parser.add_argument('--gzip', action='store_true', default=None,
+                        help='gzip exported files (default: by .gz suffix)')
+    parser.add_argument('--parts', type=int, default=None,
+                        help='export/profile a table in N parallel parts')
+    parser.add_argument('--from', dest='sources', nargs='+', default=None,
+                        help='merge: sqlite files to merge into sql_path')
+    parser.add_argument('--dedup', action='store_true',
+                        help='merge: skip rows already in sql_path')
+    parser.add_argument('--rows', type=int, default=50000,
+                        help='bench: rows per workload')
+    parser.add_argument('--workload', nargs='+', default=None,
+                        help='bench: narrow_int wide_text blob sparse_drift')
+    parser.add_argument('--baseline', default=None,
+                        help='bench: baseline json to compare against')
+    parser.add_argument('--save-baseline', default=None,
+                        help='bench: write the results as a baseline json')
+    parser.add_argument('--tolerance', type=float, default=0.3,
+                        help='bench: allowed rows/s drop vs the baseline')
 
     args = parser.parse_args()
     logging.basicConfig(level=args.log_level)
@@ -26,9 +58,16 @@ if __name__ == '__main__':
 
     if args.action == 'counts':
         with Sq(args.sql_path, replace=False) as sq:
-            result = sq.counts()
+            result = sq.counts(approx=args.approx)
             print(result)
 
+    elif args.action == 'profile':
+        with Sq(args.sql_path, replace=False) as sq:
+            tables = [args.table] if args.table else sq.tables()
+            result = {table: sq.profile(table, parts=args.parts)
+                      for table in tables}
+            print(json.dumps(result, indent=2, default=repr))
+
     elif args.action == 'load':
         with Sq(args.sql_path, replace=args.replace_db) as sq:
             input_file = args.input_file
@@ -40,3 +79,38 @@ if __name__ == '__main__':
                 append=args.append,
                 has_header=not args.no_header
             )
+
+    elif args.action == 'export':
+        if not args.output_file:
+            raise ValueError("specify output file -o")
+        source = args.query or args.table
+        if not source:
+            raise ValueError("specify table -t or query -q")
+        fmt = args.format
+        if fmt is None:
+            fmt = 'jsonl' if '.jsonl' in args.output_file else 'csv'
+        with Sq(args.sql_path, replace=False) as sq:
+            if fmt == 'csv':
+                n = sq.to_csv(source, args.output_file, compress=args.gzip,
+                              parts=args.parts)
+            else:
+                n = sq.to_jsonl(source, args.output_file, compress=args.gzip,
+                                parts=args.parts)
+            log.info(f"exported {n} rows")
+
+    elif args.action == 'merge':
+        if not args.sources:
+            raise ValueError("specify files to merge --from")
+        with Sq(args.sql_path, replace=args.replace_db) as sq:
+            result = sq.merge_from(
+                args.sources,
+                tables=[args.table] if args.table else None,
+                dedup=args.dedup)
+            print(result)
+
+    elif args.action == 'bench':
+        # sql_path is a scratch database: refused if it exists, removed
+        sys.exit(bench.main(args.sql_path, rows=args.rows,
+                            names=args.workload, baseline=args.baseline,
+                            save_baseline=args.save_baseline,
+                            tolerance=args.tolerance))
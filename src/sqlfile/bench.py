@@ -0,0 +1,204 @@
+"""Reproducible throughput benchmarks of the ingest, update and scan paths.
+
+Synthetic workloads of configurable size are written, loaded, updated and
+scanned through Sq; every step reports rows/s and the peak RSS, and can
+be compared against a stored baseline JSON to catch regressions."""
+import csv
+import json
+import logging
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+from sqlfile.sqlfile import Sq
+
+try:
+    import resource
+except ImportError:  # not on Windows
+    resource = None
+
+
+log = logging.getLogger('sql_storage')
+
+
+def _narrow_int(n, rnd):
+    for i in range(n):
+        yield {f"c{j}": rnd.randint(0, 1 << 30) for j in range(5)}
+
+
+def _wide_text(n, rnd, width=50, chars=20):
+    alphabet = 'abcdefghijklmnopqrstuvwxyz0123456789'
+    for i in range(n):
+        yield {f"c{j}": ''.join(rnd.choices(alphabet, k=chars))
+               for j in range(width)}
+
+
+def _blob(n, rnd, size=1024):
+    for i in range(n):
+        yield {'c0': i, 'raw': rnd.randbytes(size)}
+
+
+def _sparse_drift(n, rnd, keys=40):
+    """Optional keys, new ones keep appearing while the load runs"""
+    for i in range(n):
+        available = 5 + (keys - 5) * i // max(n, 1)
+        row = {'c0': i}
+        for j in rnd.sample(range(available), min(5, available)):
+            row[f"k{j}"] = rnd.randint(0, 1000)
+        yield row
+
+
+workloads = {
+    'narrow_int': _narrow_int,
+    'wide_text': _wide_text,
+    'blob': _blob,
+    'sparse_drift': _sparse_drift,
+}
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return rss / (1 << 20) if sys.platform == 'darwin' else rss / 1024
+
+
+def _timed(results, name, rows, fn, repeat=False, min_time=0.2):
+    """Time fn(); with `repeat` (fn must be idempotent) it runs again
+    until `min_time` has passed and the best run counts, so that
+    sub-millisecond steps are not pure timer noise"""
+    best, spent = None, 0.0
+    while best is None or (repeat and spent < min_time):
+        start = time.perf_counter()
+        fn()
+        seconds = time.perf_counter() - start
+        spent += seconds
+        best = seconds if best is None else min(best, seconds)
+    seconds = best
+    results[name] = dict(rows=rows, seconds=round(seconds, 4),
+                         rows_per_s=round(rows / seconds, 1) if seconds
+                         else None,
+                         peak_rss_mb=peak_rss_mb())
+    log.info(f"{name}: {results[name]}")
+
+
+def _write_csv(path, rows):
+    header = list(dict.fromkeys(key for row in rows for key in row))
+    with open(path, 'w', newline='') as f:
+        w = csv.DictWriter(f, fieldnames=header)
+        w.writeheader()
+        w.writerows(rows)
+
+
+def run(path, rows=50000, names=None, seed=0, bulk_limit=5000):
+    """Run the benchmarks on a scratch database at `path` (IOError if it
+    exists, it is removed afterwards),
+    returns {benchmark: {rows, seconds, rows_per_s, peak_rss_mb}}
+    (for *.counts_maintained rows are calls of counts()).
+
+    peak_rss_mb is the peak of the process so far (it never goes down),
+    the workload rows are generated up front and are part of it."""
+    if Path(path).exists():
+        raise IOError(f"'{path}' exists, the benchmark needs a scratch path")
+    try:
+        return _run(path, rows, names, seed, bulk_limit)
+    finally:
+        for suffix in ('', '-journal'):
+            Path(f"{path}{suffix}").unlink(missing_ok=True)
+
+
+def _run(path, rows, names, seed, bulk_limit):
+    results = dict()
+    for name in names or workloads:
+        data = list(workloads[name](rows, random.Random(seed)))
+
+        def _writerow():
+            with Sq(path, replace=True, silent=True,
+                    bulk_limit=bulk_limit) as sq:
+                for row in data:
+                    sq.writerow('t', row)
+        _timed(results, f"{name}.writerow", rows, _writerow)
+
+        with Sq(path, silent=True, bulk_limit=bulk_limit) as sq:
+            _timed(results, f"{name}.iter_table", rows,
+                   lambda: sum(1 for _ in sq.iter_table('t')), repeat=True)
+            _timed(results, f"{name}.counts", rows,
+                   lambda: sq.counts(refresh=True), repeat=True)
+            # maintained count: a lookup, not a scan, so its "rows" are
+            # calls: calls/s over 1000 calls
+            _timed(results, f"{name}.counts_maintained", 1000,
+                   lambda: [sq.counts('t') for _ in range(1000)],
+                   repeat=True)
+
+        if name == 'blob':
+            continue
+        with tempfile.TemporaryDirectory() as tmp:
+            csv_path = str(Path(tmp) / f"{name}.csv")
+            _write_csv(csv_path, data)
+            with Sq(path, replace=True, silent=True,
+                    bulk_limit=bulk_limit) as sq:
+                _timed(results, f"{name}.read_csv", rows,
+                       lambda: sq.read_csv('t', csv_path))
+
+    with Sq(path, replace=True, silent=True, bulk_limit=bulk_limit) as sq:
+        sq.read_iter('t', _narrow_int(rows, random.Random(seed)))
+        sq.flush()
+
+        def _update_field():
+            for i in range(rows):
+                sq.update_field('t', 'c1', i, keys={'rowid': i + 1})
+            sq.flush(finalize=True)
+        _timed(results, 'update_field', rows, _update_field)
+
+        _timed(results, 'mark_with_bit', rows,
+               lambda: sq.mark_with_bit('t', 1, where='c0 % 2 = 0'))
+        _timed(results, 'iter_by_bit', rows,
+               lambda: sum(1 for _ in sq.iter_by_bit('t', 1)), repeat=True)
+        _timed(results, 'change_column_type', rows,
+               lambda: sq.change_column_type('t', 'c2', 'INTEGER'))
+    return results
+
+
+def compare(results, baseline, tolerance=0.3):
+    """{benchmark: rows/s ratio to the baseline} and the names which are
+    slower than the baseline by more than `tolerance`. Only runs of the
+    same size are compared (fixed costs make rows/s depend on it)."""
+    ratios = dict()
+    regressions = list()
+    for name, result in results.items():
+        base = baseline.get(name, dict())
+        if base.get('rows') != result['rows']:
+            log.warning(f"{name}: no baseline for {result['rows']} rows")
+            continue
+        base = base.get('rows_per_s')
+        if not base or not result['rows_per_s']:
+            continue
+        ratios[name] = round(result['rows_per_s'] / base, 3)
+        if ratios[name] < 1 - tolerance:
+            regressions.append(name)
+    return ratios, regressions
+
+
+def main(path, rows=50000, names=None, baseline=None, save_baseline=None,
+         tolerance=0.3):
+    """Run, print a report and return the exit code: 1 on regressions"""
+    results = run(path, rows=rows, names=names)
+    ratios, regressions = dict(), list()
+    if baseline and Path(baseline).exists():
+        with open(baseline) as f:
+            ratios, regressions = compare(results, json.load(f), tolerance)
+
+    print(f"{'benchmark':<32}{'rows/s':>14}{'vs base':>10}{'rss MB':>10}")
+    for name, result in results.items():
+        ratio = f"{ratios[name]:.2f}x" if name in ratios else '-'
+        rss = result['peak_rss_mb']
+        print(f"{name:<32}{result['rows_per_s'] or 0:>14,.0f}{ratio:>10}"
+              f"{rss or 0:>10.1f}" + ('  REGRESSION' if name in regressions
+                                      else ''))
+
+    if save_baseline:
+        with open(save_baseline, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    return 1 if regressions else 0
@@ -0,0 +1,77 @@
+"""Counters and timing histograms of the Sq write path"""
+from collections import Counter
+
+
+class Timing:
+    """Latency histogram with power of two microsecond buckets"""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        self.buckets = Counter()  # b: observations in [2**(b-1), 2**b) us
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        if self.min is None or seconds < self.min:
+            self.min = seconds
+        if self.max is None or seconds > self.max:
+            self.max = seconds
+        self.buckets[int(seconds * 1e6).bit_length()] += 1
+
+    def quantile(self, q):
+        """Upper bound (seconds) of the bucket holding the q-quantile"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                return min((1 << bucket) / 1e6, self.max)
+        return self.max
+
+    def summary(self):
+        return dict(count=self.count, total=self.total,
+                    mean=self.total / self.count if self.count else None,
+                    min=self.min, max=self.max,
+                    p50=self.quantile(0.5), p99=self.quantile(0.99))
+
+
+class Metrics:
+    """Named counters and timings. Every increment / observation is also
+    passed to the registered callbacks as `callback(name, value)`."""
+
+    def __init__(self):
+        self.counters = Counter()
+        self.timings = dict()
+        self.callbacks = list()
+
+    def add_callback(self, callback):
+        self.callbacks.append(callback)
+
+    def remove_callback(self, callback):
+        self.callbacks.remove(callback)
+
+    def incr(self, name, n=1):
+        self.counters[name] += n
+        for callback in self.callbacks:
+            callback(name, n)
+
+    def observe(self, name, seconds):
+        if name not in self.timings:
+            self.timings[name] = Timing()
+        self.timings[name].add(seconds)
+        for callback in self.callbacks:
+            callback(name, seconds)
+
+    def reset(self):
+        self.counters.clear()
+        self.timings.clear()
+
+    def snapshot(self):
+        return dict(counters=dict(self.counters),
+                    timings={name: timing.summary()
+                             for name, timing in self.timings.items()})
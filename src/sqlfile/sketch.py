@@ -0,0 +1,195 @@
+"""Mergeable one-pass summaries used by Sq.profile"""
+import math
+from collections import Counter
+from hashlib import blake2b
+
+
+_mask = (1 << 64) - 1
+_sqlite_types = {int: 'INTEGER', float: 'REAL', str: 'TEXT', bytes: 'BLOB',
+                 bool: 'INTEGER'}
+# sqlite sort order of storage classes
+_type_rank = {int: 0, float: 0, bool: 0, str: 1, bytes: 2}
+
+
+def _sort_key(value):
+    return _type_rank.get(type(value), 3), value
+
+
+def _hash(value):
+    """64 bit hash that is the same in every process (hash() of str and
+    bytes is salted), so sketches built in worker processes merge"""
+    if isinstance(value, str):
+        value = value.encode('utf-8', 'surrogatepass')
+    if isinstance(value, bytes):
+        return int.from_bytes(blake2b(value, digest_size=8).digest(), 'big')
+    return _mix(hash(value) & _mask)
+
+
+def _mix(x):
+    """splitmix64 finalizer: spreads hash() (which is the value itself
+    for small ints) over all 64 bits"""
+    z = (x + 0x9E3779B97F4A7C15) & _mask
+    z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & _mask
+    z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & _mask
+    return z ^ (z >> 31)
+
+
+class HyperLogLog:
+    """Approximate distinct count, ~1.04 / sqrt(2 ** p) relative error"""
+
+    def __init__(self, p=12):
+        self.p = p
+        self.m = 1 << p
+        self.registers = bytearray(self.m)
+
+    def update(self, values):
+        p, registers = self.p, self.registers
+        shift, width = 64 - p, 64 - p
+        low = (1 << width) - 1
+        for value in values:
+            h = _hash(value)
+            idx = h >> shift
+            rank = width - (h & low).bit_length() + 1
+            if rank > registers[idx]:
+                registers[idx] = rank
+
+    def merge(self, other):
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+    def estimate(self):
+        m = self.m
+        alpha = 0.7213 / (1 + 1.079 / m)
+        e = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if e <= 2.5 * m and zeros:
+            e = m * math.log(m / zeros)
+        return int(round(e))
+
+
+class HeavyHitters:
+    """Misra-Gries frequent items summary with `capacity` counters.
+
+    Counts are underestimated by at most n / (capacity + 1); items seen
+    more often than that are always kept. Exact (`exact`) while the
+    number of distinct values stays within capacity."""
+
+    def __init__(self, capacity=100):
+        self.capacity = capacity
+        self.counts = Counter()
+        self.exact = True
+
+    def update(self, values):
+        self.counts.update(values)
+        self._trim()
+
+    def merge(self, other):
+        self.counts.update(other.counts)
+        self.exact &= other.exact
+        self._trim()
+
+    def _trim(self):
+        if len(self.counts) <= self.capacity:
+            return
+        self.exact = False
+        kept = self.counts.most_common(self.capacity + 1)
+        cut = kept[-1][1]
+        self.counts = Counter({value: n - cut for value, n in kept[:-1]
+                               if n > cut})
+
+    def top(self, k):
+        return self.counts.most_common(k)
+
+
+class ColumnProfile:
+    """Nulls, min/max, storage and inferred types, approximate distinct
+    count and frequent values of one column, updated batch by batch."""
+
+    def __init__(self, top_k=10):
+        self.top_k = top_k
+        self.count = 0
+        self.nulls = 0
+        self.min = None
+        self.max = None
+        self.types = Counter()
+        self.numeric_text = {int: True, float: True}
+        self.distinct = HyperLogLog()
+        self.frequent = HeavyHitters(max(100, 10 * top_k))
+
+    def update(self, values):
+        self.count += len(values)
+        nulls = values.count(None)
+        self.nulls += nulls
+        if nulls:
+            values = [v for v in values if v is not None]
+        if not values:
+            return
+        types = Counter(map(type, values))
+        self.types.update(types)
+
+        key = None if len(types) == 1 else _sort_key
+        self._bounds(min(values, key=key), max(values, key=key))
+
+        if str in types and any(self.numeric_text.values()):
+            self._infer_text([v for v in values if type(v) is str])
+        self.distinct.update(values)
+        self.frequent.update(values)
+
+    def _bounds(self, lo, hi):
+        if self.min is None or _sort_key(lo) < _sort_key(self.min):
+            self.min = lo
+        if self.max is None or _sort_key(hi) > _sort_key(self.max):
+            self.max = hi
+
+    def _infer_text(self, values):
+        for cast in (int, float):
+            if not self.numeric_text[cast]:
+                continue
+            try:
+                for v in values:
+                    cast(v)
+            except ValueError:
+                self.numeric_text[cast] = False
+
+    def merge(self, other):
+        self.count += other.count
+        self.nulls += other.nulls
+        self.types.update(other.types)
+        for cast in (int, float):
+            self.numeric_text[cast] &= other.numeric_text[cast]
+        if other.min is not None:
+            self._bounds(other.min, other.max)
+        self.distinct.merge(other.distinct)
+        self.frequent.merge(other.frequent)
+
+    def inferred_type(self):
+        types = {_sqlite_types.get(t, 'BLOB') for t in self.types}
+        if not types:
+            return None
+        if types == {'TEXT'}:
+            if self.numeric_text[int]:
+                return 'INTEGER'
+            if self.numeric_text[float]:
+                return 'REAL'
+        if types <= {'INTEGER', 'REAL'}:
+            return 'REAL' if 'REAL' in types else 'INTEGER'
+        return 'TEXT' if len(types) > 1 else types.pop()
+
+    def result(self):
+        types = Counter()
+        for t, n in self.types.items():
+            types[_sqlite_types.get(t, 'BLOB')] += n
+        if self.frequent.exact:
+            distinct = len(self.frequent.counts)
+        else:
+            distinct = min(self.distinct.estimate(), self.count - self.nulls)
+        return dict(
+            count=self.count,
+            nulls=self.nulls,
+            min=self.min,
+            max=self.max,
+            types=dict(types),
+            inferred_type=self.inferred_type(),
+            distinct=distinct,
+            distinct_exact=self.frequent.exact,
+            top=self.frequent.top(self.top_k),
+        )
@@ -1,13 +1,67 @@
 import sqlite3
 import logging
+import base64
+import bz2
 import csv
+import gzip
+import io
+import itertools
+import json
+import lzma
+import math
+import os
+import queue
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
 import typing
+import zlib
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from pathlib import Path
 from tqdm import tqdm
+from sqlfile.metrics import Metrics
+from sqlfile.sketch import ColumnProfile
 
 
 __version__ = "0.1.1"
 status_field = 'DB_ROW_STATUS'
+meta_prefix = '_sq_'
+counts_table = f'{meta_prefix}counts'
+checkpoints_table = f'{meta_prefix}checkpoints'
+watermarks_table = f'{meta_prefix}watermarks'
+fts_table = f'{meta_prefix}fts'
+
+# [name], "name", `name`, 'name' or a bare name
+_ident = r"""(\[[^\]]+\]|"(?:[^"]|"")+"|`[^`]+`|'[^']+'|[^\s.(\["'`]+)"""
+# INSERT/DELETE statements whose row delta can be taken from rowcount
+_dml_count_re = re.compile(
+    r"^\s*(DELETE\s+FROM|INSERT(?:\s+OR\s+(?:IGNORE|ABORT|FAIL|ROLLBACK))?"
+    rf"\s+INTO)\s+(?:{_ident}\s*\.\s*)?{_ident}", re.IGNORECASE)
+_upsert_re = re.compile(r"\bON\s+CONFLICT\b", re.IGNORECASE)
+# statements which never change the number of rows in a table
+_no_count_re = re.compile(r"^\s*(SELECT|UPDATE(?!\s+OR\s+REPLACE)|PRAGMA|"
+                          r"VACUUM|ANALYZE|"
+                          r"CREATE\s+(UNIQUE\s+)?INDEX|DROP\s+INDEX|"
+                          r"ALTER\s+TABLE\s+\S+\s+(ADD|DROP|RENAME\s+COLUMN)"
+                          r")\b", re.IGNORECASE)
+# queries whose result rows depend on more than one source row
+_aggregate_re = re.compile(
+    r"\b(GROUP\s+BY|DISTINCT)\b|"
+    r"\b(COUNT|SUM|TOTAL|AVG|MIN|MAX|GROUP_CONCAT|STRING_AGG)\s*\(",
+    re.IGNORECASE)
+
+
+def _unquote(name):
+    """Identifier matched by _ident without its quotes"""
+    if name[0] == '[':
+        return name[1:-1]
+    if name[0] in '"`\'':
+        return name[1:-1].replace(name[0] * 2, name[0])
+    return name
+
 
 logging.basicConfig(level='INFO',
                         format='%(filename)s.%(funcName)s:[%(lineno)d] '
@@ -29,6 +83,393 @@ def count_lines(path, chunk_size=0x10000):
     return lines
 
 
+_magic = [
+    (b'\x1f\x8b', lambda: zlib.decompressobj(wbits=31)),
+    (b'BZh', bz2.BZ2Decompressor),
+    (b'\xfd7zXZ\x00', lzma.LZMADecompressor),
+]
+
+
+def _decompressor(head: bytes):
+    """Decompressor factory for data starting with `head`, or None"""
+    for magic, factory in _magic:
+        if head.startswith(magic):
+            return factory
+    return None
+
+
+def _is_plain_file(path):
+    if not isinstance(path, (str, Path)) or str(path) == '-':
+        return False
+    with open(path, 'rb') as f:
+        return _decompressor(f.read(6)) is None
+
+
+class _DecompressReader(io.RawIOBase):
+    """Decompresses `raw` in a background thread, so zlib/bz2/lzma
+    (which release the GIL) overlap with parsing in the caller.
+    Concatenated streams (e.g. multi-member gzip) are supported."""
+
+    def __init__(self, raw, factory, chunk_size=1 << 20, queue_size=8):
+        super().__init__()
+        self._raw = raw
+        self._factory = factory
+        self._chunk_size = chunk_size
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._pending = b''
+        self._done = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        try:
+            d = self._factory()
+            started = False  # d has consumed input
+            while not self._stop.is_set():
+                chunk = self._raw.read(self._chunk_size)
+                if not chunk:
+                    break
+                while chunk:
+                    if not started:
+                        # NUL padding between / after members (gzip.open
+                        # skips it too); no magic starts with NUL
+                        chunk = chunk.lstrip(b'\x00')
+                        if not chunk:
+                            break
+                    data = d.decompress(chunk)
+                    started = True
+                    if data and not self._put(data):
+                        return
+                    chunk = b''
+                    if d.eof:
+                        chunk = d.unused_data
+                        d = self._factory()
+                        started = False
+            if started and not d.eof and not self._stop.is_set():
+                raise EOFError("Compressed file ended before the "
+                               "end-of-stream marker was reached")
+            self._put(None)
+        except Exception as exc:
+            self._put(exc)
+
+    def _put(self, item):
+        """Queue `item` unless closed meanwhile (then returns False)"""
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not self._pending:
+            if self._done:
+                return 0
+            item = self._queue.get()
+            if item is None:
+                self._done = True
+            elif isinstance(item, Exception):
+                self._done = True
+                raise item
+            else:
+                self._pending = item
+        n = min(len(b), len(self._pending))
+        b[:n] = self._pending[:n]
+        self._pending = self._pending[n:]
+        return n
+
+    def close(self):
+        if not self.closed:
+            self._stop.set()
+            try:
+                while True:
+                    self._queue.get_nowait()
+            except queue.Empty:
+                pass
+            self._thread.join(timeout=1)
+            self._raw.close()
+        super().close()
+
+
+class _Borrowed(io.RawIOBase):
+    """Reads a caller's binary stream; close() leaves it open"""
+
+    def __init__(self, f):
+        super().__init__()
+        self._f = f
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        if hasattr(self._f, 'readinto'):
+            return self._f.readinto(b)
+        data = self._f.read(len(b))
+        b[:len(data)] = data
+        return len(data)
+
+
+class _BorrowedText(io.TextIOBase):
+    """Reads a caller's text stream; close() leaves it open"""
+
+    def __init__(self, f):
+        super().__init__()
+        self._f = f
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        return self._f.read(size)
+
+    def readline(self, size=-1):
+        return self._f.readline(size)
+
+    def __iter__(self):
+        self._checkClosed()
+        return iter(self._f)
+
+
+def open_input(source, encoding='utf-8', newline=''):
+    """Text stream for reading a path, '-' (stdin) or a file object.
+
+    gzip, bz2 and xz input is detected by magic bytes and decompressed in
+    a background thread. Closing the stream does not close a file object
+    passed in as `source`."""
+    if isinstance(source, io.TextIOBase):
+        return _BorrowedText(source)
+    if source is None or source == '':
+        raise IOError(f"No such file '{source}'")
+    if isinstance(source, (str, Path)):
+        if str(source) == '-':
+            raw = open(sys.stdin.fileno(), 'rb', closefd=False)
+        elif not Path(source).exists():
+            raise IOError(f"No such file '{source}'")
+        else:
+            raw = open(source, 'rb')
+    else:
+        raw = io.BufferedReader(_Borrowed(source), buffer_size=1 << 20)
+
+    factory = _decompressor(raw.peek(6)[:6])
+    if factory is not None:
+        raw = io.BufferedReader(_DecompressReader(raw, factory),
+                                buffer_size=1 << 20)
+    return io.TextIOWrapper(raw, encoding=encoding, newline=newline)
+
+
+def _source_id(source):
+    """Identity of an input recorded with its checkpoint"""
+    if isinstance(source, (str, Path)) and str(source) != '-':
+        st = Path(source).stat()
+        return f"{Path(source).resolve()}:{st.st_size}:{st.st_mtime_ns}"
+    if str(source) == '-':
+        return 'stdin'
+    return str(getattr(source, 'name', source))
+
+
+class _OffsetLines:
+    """Decoded lines of a binary file, tracking the byte offset of the
+    end of the last line read (csv.reader does not read ahead)"""
+
+    def __init__(self, f, encoding='utf-8'):
+        self.f = f
+        self.encoding = encoding
+        self.offset = f.tell()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        line = self.f.readline()
+        if not line:
+            raise StopIteration
+        self.offset += len(line)
+        return line.decode(self.encoding)
+
+    def seek(self, offset):
+        self.f.seek(offset)
+        self.offset = offset
+
+
+def _open_output(path, compress=None, buffer_size=1 << 20):
+    """Text file for writing, gzip-compressed if `compress` or *.gz"""
+    if compress is None:
+        compress = str(path).endswith('.gz')
+    if compress:
+        return gzip.open(path, 'wt', newline='', encoding='utf-8',
+                         compresslevel=6)
+    return open(path, 'w', newline='', encoding='utf-8',
+                buffering=buffer_size)
+
+
+def _part_path(path, i):
+    """out.csv.gz -> out-00001.csv.gz"""
+    path = Path(path)
+    stem, dot, suffixes = path.name.partition('.')
+    return path.with_name(f"{stem}-{i:05d}{dot}{suffixes}")
+
+
+def _json_default(value):
+    if isinstance(value, bytes):
+        return base64.b64encode(value).decode('ascii')
+    raise TypeError(f"{type(value)} is not JSON serializable")
+
+
+def _flatten(obj, sep='.', max_depth=None, prefix='', depth=1, out=None):
+    """{'a': {'b': 1}, 'c': [1]} -> {'a.b': 1, 'c': '[1]'}
+
+    Objects nested deeper than `max_depth` levels and lists are kept as
+    JSON strings, so every value fits an sqlite column."""
+    if out is None:
+        out = dict()
+    for key, value in obj.items():
+        name = f"{prefix}{sep}{key}" if prefix else key
+        if isinstance(value, dict) and sep is not None and (
+                max_depth is None or depth < max_depth):
+            _flatten(value, sep, max_depth, name, depth + 1, out)
+        elif isinstance(value, (dict, list)):
+            out[name] = json.dumps(value)
+        else:
+            out[name] = value
+    return out
+
+
+def _export_rows(db, query, params, path, fmt, header=True, compress=None,
+                 batch_size=10000, csv_opts=None, bar=None):
+    c = db.cursor()
+    c.row_factory = None
+    c.execute(query, params)
+    names = [d[0] for d in c.description]
+    n = 0
+    with _open_output(path, compress) as f:
+        if fmt == 'csv':
+            w = csv.writer(f, **(csv_opts or dict()))
+            if header:
+                w.writerow(names)
+        while True:
+            batch = c.fetchmany(batch_size)
+            if not batch:
+                break
+            if fmt == 'csv':
+                # type() of every value in C; csv would write bytes' repr
+                if bytes in set(map(type, itertools.chain(*batch))):
+                    batch = [tuple(_json_default(v) if type(v) is bytes
+                                   else v for v in row) for row in batch]
+                w.writerows(batch)
+            else:
+                f.write(''.join(
+                    json.dumps(dict(zip(names, row)), default=_json_default)
+                    + '\n' for row in batch))
+            n += len(batch)
+            if bar is not None:
+                bar.update(len(batch))
+    return n
+
+
+def _profile_rows(db, table, columns, where='', params=(),
+                  batch_size=10000, top_k=10):
+    c = db.cursor()
+    c.row_factory = None
+    columns_s = ', '.join(f'"{column}"' for column in columns)
+    c.execute(f"SELECT {columns_s} FROM [{table}]{where}", params)
+    profiles = [ColumnProfile(top_k) for _ in columns]
+    while True:
+        batch = c.fetchmany(batch_size)
+        if not batch:
+            break
+        for profile, values in zip(profiles, zip(*batch)):
+            profile.update(values)
+    return profiles
+
+
+def _profile_part(uri, table, columns, lo, hi, batch_size, top_k):
+    db = sqlite3.connect(uri, uri=True)
+    try:
+        return _profile_rows(db, table, columns,
+                             " WHERE rowid BETWEEN ? AND ?", (lo, hi),
+                             batch_size, top_k)
+    finally:
+        db.close()
+
+
+class Schema:
+    """Cached catalog of a connection: tables, columns, types and indexes.
+
+    Everything is reloaded only when `PRAGMA schema_version` changes, so
+    `check()` is a single cheap query and also picks up DDL done by other
+    connections. Column info is read lazily per table. `on_change()` is
+    called on reloads after the first that changed a user-visible object
+    (not the internal `_sq_` / `sqlite_` ones)."""
+
+    def __init__(self, db, on_change=None):
+        self.db = db
+        self.on_change = on_change
+        self.version = None
+        self._tables = dict()  # table: {column: info} or None (not loaded)
+        self._indexes = dict()  # table: [index names]
+        self._visible = None  # {(name, sql)} of user-visible objects
+
+    def check(self):
+        """Reload the catalog if the schema changed; True if it did."""
+        version = self.db.execute('PRAGMA schema_version').fetchone()[0]
+        if version == self.version:
+            return False
+        log.debug("schema_version: %s -> %s", self.version, version)
+        self._tables = dict()
+        self._indexes = dict()
+        visible = set()
+        q = "select type, name, tbl_name, sql from sqlite_master"
+        for obj_type, name, tbl_name, sql in self.db.execute(q):
+            if obj_type == 'table':
+                self._tables[name] = None
+            elif obj_type == 'index':
+                self._indexes.setdefault(tbl_name, list()).append(name)
+            if not name.startswith((meta_prefix, 'sqlite_')):
+                visible.add((name, sql))
+        if self._visible is not None and visible != self._visible \
+                and self.on_change is not None:
+            self.on_change()
+        self._visible = visible
+        self.version = version
+        return True
+
+    def invalidate(self):
+        self.version = None
+
+    def tables(self):
+        if self.version is None:
+            self.check()
+        return list(self._tables)
+
+    def header(self, table):
+        """{column: {cid, col_type, notnull, default, pk}}, cached."""
+        if self.version is None:
+            self.check()
+        if table not in self._tables:
+            raise sqlite3.OperationalError("No such table: {}".format(table))
+        if self._tables[table] is None:
+            columns = dict()
+            for row in self.db.execute(f"pragma table_info([{table}])"):
+                cid, name, col_type, notnull, default, pk = row
+                columns[name] = dict(cid=cid, col_type=col_type,
+                                     notnull=notnull, default=default, pk=pk)
+            self._tables[table] = columns
+        return self._tables[table]
+
+    def columns(self, table):
+        return list(self.header(table))
+
+    def indexes(self, table):
+        if self.version is None:
+            self.check()
+        return list(self._indexes.get(table, list()))
+
+
 class Sq:
     """
     Useful methods:
@@ -37,6 +478,7 @@ class Sq:
         - list_all_tables()
         - list_fields(table_name)
         - iter_table(table_name)
+        - sample(table_name, n)
         -
 
     Other:
@@ -52,24 +494,56 @@ class Sq:
                  append=False,
                  silent=False,
                  bulk_limit=5000,
-                 replace=False
+                 replace=False,
+                 staging=None,
+                 snapshot_interval=None,
+                 auto_vacuum=None
                  ):
+        """`staging='memory'` (or a directory, e.g. on tmpfs) writes to a
+        staging database which is copied to `path` with the backup API on
+        close() and every `snapshot_interval` seconds (checked on flush).
+
+        `auto_vacuum` ('NONE', 'FULL' or 'INCREMENTAL', see `reclaim`) is
+        applied to new files; an existing file in another mode is
+        converted with a one-time VACUUM."""
         self.path = path
         self.bulk_limit = bulk_limit
         self.buffer = dict()
         self.buffer_updates = dict()
         self.silent = silent
         self._append = append
+        self.staging = staging
+        self.snapshot_interval = snapshot_interval
+        self._last_snapshot = time.monotonic()
 
         # sup
-        self._field_names = dict()  # table: [fields...]
+        self._field_names = dict()  # table: [fields...] of buffered rows
+        self._checkpoints = dict()  # table: {source, position, rows}
+        self._fts_flush = None  # table: [columns, watermark], sync='flush'
+        self._profiles = dict()  # (table, columns, top_k): (version, result)
         if replace:
             log.debug(f"replace: {Path(self.path).resolve().absolute()}")
             if Path(self.path).exists():
                 Path(self.path).unlink()
 
         log.debug(f"open: {Path(self.path).resolve().absolute()}")
-        self.db = sqlite3.connect(str(self.path))
+        if staging is None:
+            self._db_path = str(self.path)
+            self.db = sqlite3.connect(self._db_path)
+        else:
+            self._db_path = ':memory:'
+            if staging != 'memory':
+                fd, self._db_path = tempfile.mkstemp(suffix='.sqlite',
+                                                     dir=staging)
+                os.close(fd)
+            log.debug(f"staging: {self._db_path}")
+            self.db = sqlite3.connect(self._db_path)
+            if Path(self.path).exists():
+                src = sqlite3.connect(str(self.path))
+                try:
+                    src.backup(self.db)
+                finally:
+                    src.close()
 
         # def _dict_factory(cursor, row):
         #     d = {}
@@ -77,6 +551,25 @@ class Sq:
         #         d[col[0]] = row[idx]
         #     return d
         self.db.row_factory = sqlite3.Row
+        self.metrics = Metrics()
+        self.schema = Schema(
+            self.db, on_change=lambda: self.metrics.incr('schema_changes'))
+
+        if auto_vacuum is not None:
+            self._set_auto_vacuum(auto_vacuum)
+
+    def _set_auto_vacuum(self, mode):
+        modes = {'NONE': 0, 'FULL': 1, 'INCREMENTAL': 2}
+        if str(mode).upper() not in modes:
+            raise ValueError(f"auto_vacuum: {mode}, expected {list(modes)}")
+        mode = str(mode).upper()
+        current = self.db.execute('PRAGMA auto_vacuum').fetchone()[0]
+        if current == modes[mode]:
+            return
+        self.db.execute(f'PRAGMA auto_vacuum = {mode}')
+        if self.schema.tables():
+            log.info(f"auto_vacuum: {current} -> {mode}, VACUUM")
+            self.db.execute('VACUUM')
 
     def __enter__(self):
         return self
@@ -87,56 +580,51 @@ class Sq:
         log.debug('closed')
 
     def detailed_header(self, table):
-        existing_tables = self.tables()
-        if table not in existing_tables:
-            raise sqlite3.OperationalError("No such table: {}".format(table))
-        else:
-            # cid, name, type, notnull, default, pk
-            q = f"pragma table_info({table})"
-            log.debug(q)
-            res = self.db.execute(q).fetchall()
-            log.debug(f"{res}")
-            columns = dict()
-            for row in res:
-                cid, name, col_type, notnull, default, pk = row
-                columns.update({name: dict()})
-                columns[name].update({'cid': cid})
-                columns[name].update({'col_type': col_type})
-                columns[name].update({'notnull': notnull})
-                columns[name].update({'default': default})
-                columns[name].update({'pk': pk})
-            return columns
+        self.schema.check()
+        # cid, name, type, notnull, default, pk
+        return {name: dict(info)
+                for name, info in self.schema.header(table).items()}
 
     def table_columns(self, table):
-        existing_tables = self.tables()
-        if table not in existing_tables:
-            raise sqlite3.OperationalError("No such table: {}".format(table))
-        else:
-            # cid, name, type, notnull, default, pk
-            q = f"pragma table_info([{table}])"
-            res = self.db.execute(q).fetchall()
-            log.debug(f"{res}")
-            header = list()
-            for row in res:
-                _, column_name, *_ = row
-                header.append(column_name)
-            # save header
-            self._field_names[table] = header
-            return header
+        self.schema.check()
+        return self.schema.columns(table)
 
-    def tables(self):
-        q = "select name from sqlite_master where type = 'table'"
-        res = self.db.execute(q).fetchall()
+    def table_indexes(self, table):
+        self.schema.check()
+        return self.schema.indexes(table)
 
-        tables = [table_desc[0] for table_desc in res]
-        log.debug(f"{tables}")
+    def tables(self):
+        self.schema.check()
+        tables = [table for table in self.schema.tables()
+                  if not table.startswith(meta_prefix)]
+        log.debug("%s", tables)
         return tables
 
+    def _sync_schema(self):
+        if self.schema.check():
+            self._sync_fields()
+
+    def _sync_fields(self):
+        """Realign the field lists of tables with nothing buffered to the
+        (reloaded) schema cache, and forget tables that are gone."""
+        tables = self.schema.tables()
+        for table in list(self._field_names):
+            if self.buffer.get(table):
+                continue
+            if table in tables:
+                self._field_names[table] = [
+                    field for field in self.schema.columns(table)
+                    if field != status_field]
+            else:
+                del self._field_names[table]
+                self.buffer.pop(table, None)
+
     def create_table(self, name: str, header: list = None, dtypes=None,
                      append=False):
 
         assert header is not None or dtypes is not None, [header, dtypes]
 
+        is_new = not append or name not in self.tables()
         if append:
             if name in self.buffer:
                 log.warning(f"{name} in buffer already")
@@ -187,27 +675,66 @@ class Sq:
         log.debug(f"exec: {q}")
         try:
             self.db.execute(q)
+            if is_new:
+                self._set_count(name, 0)
             self.db.commit()
         except sqlite3.OperationalError as exc:
             log.error(f"create_table: `{q}`")
             raise exc
 
         # save header
-        self._field_names[name] = self.table_columns(name)
+        self.schema.check()
+        self._field_names[name] = [field
+                                   for field in self.schema.columns(name)
+                                   if field != status_field]
 
     def close(self):
         self.flush(finalize=True)
+        if self.staging is not None:
+            self._snapshot(self.path)
         self.db.close()
+        if self.staging not in (None, 'memory'):
+            Path(self._db_path).unlink()
         log.debug('closed')
 
-    def execute(self, q):
+    def snapshot(self, dest, pages=4096, sleep=0.001):
+        """Online copy of the database to `dest` with the sqlite backup
+        API, `pages` pages per step so other connections get the lock in
+        between. Written to `dest`.tmp and renamed into place."""
+        self.flush(finalize=True)
+        self._snapshot(dest, pages, sleep)
+
+    def _snapshot(self, dest, pages=4096, sleep=0.001):
+        self._last_snapshot = time.monotonic()
+        tmp = Path(f"{dest}.tmp")
+        if tmp.exists():
+            tmp.unlink()
+        dst = sqlite3.connect(str(tmp))
+        with tqdm(desc=f'backup: {dest}', unit='page', disable=self.silent,
+                  leave=False) as bar:
+
+            def _progress(status, remaining, total):
+                bar.total = total
+                bar.update(total - remaining - bar.n)
+
+            try:
+                self.db.backup(dst, pages=pages, progress=_progress,
+                               sleep=sleep)
+            finally:
+                dst.close()
+        os.replace(tmp, dest)
+        log.debug(f"snapshot: {dest}")
+
+    def execute(self, q, params=()):
         self.flush(True)
         try:
-            self.db.execute(q)
+            c = self.db.execute(q, params)
         except sqlite3.OperationalError as e:
             log.error(f"{q}")
             raise e
+        self._track_counts(q, c.rowcount)
         self.db.commit()
+        self._sync_schema()
 
     def executescript(self, q):
         self.flush(True)
@@ -216,21 +743,23 @@ class Sq:
         except sqlite3.OperationalError as e:
             log.error(f"```{q}```")
             raise e
+        self._forget_counts(q)
         self.db.commit()
+        self._sync_schema()
 
     def flush(self, finalize=False):
 
         log.debug('flash')
+        schema_changed = self.schema.check()
+        pages = None
         for table_name in self.buffer.keys():
             if len(self.buffer[table_name]) > 0:
-                log.debug(f"{table_name}: {len(self.buffer[table_name])}")
+                n_rows = len(self.buffer[table_name])
+                log.debug("%s: %s", table_name, n_rows)
+                if pages is None:
+                    pages = self._page_count()
                 fields = self._field_names[table_name]
-
-                n_fields = len(self._field_names[table_name])
-                # TODO:
-                if fields[-1] == 'DB_ROW_STATUS':
-                    fields = fields[:-1]
-                    n_fields -= 1
+                n_fields = len(fields)
 
                 fields_s = '`,`'.join(fields)
                 values_tags = ','.join(
@@ -238,35 +767,130 @@ class Sq:
                 )
                 q = f'INSERT INTO [{table_name}] (`{fields_s}`) ' + \
                     f'VALUES({values_tags})'
-                log.debug(f"Executemany: {q}")
+                log.debug("Executemany: %s", q)
 
                 try:
-                    self.db.executemany(
+                    start = time.perf_counter()
+                    c = self.db.executemany(
                         q,
                         self.buffer[table_name]
                     )
-                    self.db.commit()
+                    self.metrics.observe('executemany',
+                                         time.perf_counter() - start)
+                    self._add_count(table_name, c.rowcount)
+                    self._sync_fts(table_name)
+                    self._save_checkpoint(table_name)
+                    self._commit()
                     self.buffer[table_name] = list()
                 except Exception as exc:
-                    log.error(f"self.buffer: {self.buffer}")
+                    # the buffer itself may be huge, log its shape only
+                    log.error(f"self.buffer[{table_name}]: {n_rows} rows, "
+                              f"first: {self.buffer[table_name][0]}")
                     log.error(f"{q}")
                     log.error(f"fields: {fields}")
                     raise exc
-
+                self.metrics.incr('rows_flushed', n_rows)
+
+        if pages is not None:
+            self.metrics.incr('flushes')
+            self.metrics.incr('db_growth_bytes', (self._page_count() - pages)
+                              * self.db.execute('PRAGMA page_size'
+                                                ).fetchone()[0])
+        if schema_changed:
+            self._sync_fields()
         self._flush_updates(finalize=finalize)
 
+        if self.snapshot_interval is not None and self.staging is not None \
+                and time.monotonic() - self._last_snapshot \
+                >= self.snapshot_interval:
+            self._snapshot(self.path)
+
+    def _commit(self):
+        start = time.perf_counter()
+        self.db.commit()
+        self.metrics.observe('commit', time.perf_counter() - start)
+
+    def _page_count(self):
+        return self.db.execute('PRAGMA page_count').fetchone()[0]
+
+    def stats(self):
+        """Write-path metrics: counters (rows_flushed, flushes,
+        db_growth_bytes, rows_updated, update_batches, schema_changes),
+        timings in seconds (executemany, commit, update_executemany) and
+        the current buffer sizes. db_growth_bytes is the growth of the
+        database file, not the bytes written: rows stored in reused free
+        pages add nothing. Register `callback(name, value)` with
+        `sq.metrics.add_callback` to get every data point as it happens."""
+        stats = self.metrics.snapshot()
+        stats['rows_buffered'] = sum(map(len, self.buffer.values()))
+        stats['updates_buffered'] = sum(map(len,
+                                            self.buffer_updates.values()))
+        stats['db_bytes'] = self._page_count() * self.db.execute(
+            'PRAGMA page_size').fetchone()[0]
+        return stats
+
     def replace_value(self, table, field, value, new_value, new_field=None):
         if new_field is None:
             new_field = field
         if value == "":
             self.execute(f"""
             UPDATE "{table}" 
-            SET "{field}" = '{new_value}' 
-            WHERE {field} = '{value}' """)
+            SET "{field}" = ? 
+            WHERE "{field}" = ? """, (new_value, value))
         else:
             self.execute(f"""
             UPDATE "{table}" 
-            SET "{field}" = REPLACE("{new_field}", '{value}', '{new_value}')""")
+            SET "{field}" = REPLACE("{new_field}", ?, ?)""",
+                         (value, new_value))
+
+    def remap_values(self, table, column, mapping: dict, mode='exact'):
+        """Replace values of `column` by `mapping` {value: new_value} in a
+        single UPDATE pass, returns the number of rows changed.
+
+        'exact' joins the column against the mapping loaded into a temp
+        table. 'substring' replaces every occurrence of the keys inside
+        the values (longest key first, in one pass, not chained)."""
+        self.flush(finalize=True)
+        if not mapping:
+            return 0
+        if mode == 'exact':
+            tmp = f"temp.{meta_prefix}map"
+            self.db.execute(f"DROP TABLE IF EXISTS {tmp}")
+            self.db.execute(f"CREATE TABLE {tmp} (old PRIMARY KEY, new)")
+            try:
+                self.db.executemany(f"INSERT INTO {tmp} VALUES (?, ?)",
+                                    mapping.items())
+                c = self.db.execute(
+                    f"UPDATE main.[{table}] SET [{column}] = m.new "
+                    f"FROM {tmp} AS m WHERE [{table}].[{column}] = m.old "
+                    f"AND [{table}].[{column}] IS NOT m.new")
+                self.db.commit()
+            finally:
+                self.db.execute(f"DROP TABLE {tmp}")
+        elif mode == 'substring':
+            keys = sorted(map(str, mapping), key=len, reverse=True)
+            pattern = re.compile('|'.join(map(re.escape, keys)))
+            replacements = {str(k): str(v) for k, v in mapping.items()}
+
+            def _remap(value):
+                if not isinstance(value, str):
+                    return value
+                return pattern.sub(lambda m: replacements[m.group()], value)
+
+            func = f"{meta_prefix}remap"
+            self.db.create_function(func, 1, _remap, deterministic=True)
+            try:
+                c = self.db.execute(
+                    f"UPDATE [{table}] SET [{column}] = {func}([{column}]) "
+                    f"WHERE {func}([{column}]) IS NOT [{column}]")
+                self.db.commit()
+            finally:
+                self.db.create_function(func, 1, None)
+        else:
+            raise ValueError(f"mode: {mode}, expected 'exact' or "
+                             f"'substring'")
+        log.debug(f"{table}.{column}: {c.rowcount} rows remapped")
+        return c.rowcount
 
     def update_field(self, table_name, field: str, value, keys: dict):
         """e.g. update FIELD1 with VAL1
@@ -284,7 +908,7 @@ class Sq:
                      f"SET [{field}] = ? " \
                      f"WHERE {q_where_clause}"
 
-        log.debug(f"{q_template}")
+        log.debug("%s", q_template)
         if q_template not in self.buffer_updates:
             self.buffer_updates[q_template] = list()
 
@@ -297,11 +921,17 @@ class Sq:
             if (len(self.buffer_updates[q_template]) >= self.bulk_limit) \
                     or finalize:
                 # Trigger
+                start = time.perf_counter()
                 self.db.executemany(
                     q_template,
                     self.buffer_updates[q_template]
                 )
-                self.db.commit()
+                self.metrics.observe('update_executemany',
+                                     time.perf_counter() - start)
+                self._commit()
+                self.metrics.incr('update_batches')
+                self.metrics.incr('rows_updated',
+                                  len(self.buffer_updates[q_template]))
                 drop_templates.append(q_template)
 
         for dt in drop_templates:
@@ -314,18 +944,21 @@ class Sq:
         self.flush(finalize=True)
         q = f"ALTER TABLE {table_name} ADD COLUMN '{column_name}' {sql_dt}"
         log.debug(q)
-        self.flush()
-        self.db.execute(q)
-        self._field_names[table_name] = list(self._field_names[table_name])
-        self._field_names[table_name].append(column_name)
-        self._field_names[table_name] = tuple(self._field_names[table_name])
+        self.schema.check()
+        # may have been added by another connection already
+        if column_name not in self.schema.header(table_name):
+            self.db.execute(q)
+            self.schema.check()
+        self._sync_fields()
 
     def rename_columns(self, table_name, column_names):
+        self.flush(finalize=True)
         for old, new in column_names.items():
             self.db.execute(f"""
             ALTER TABLE '{table_name}' 
             RENAME COLUMN '{old}' to '{new}'
             """)
+        self._sync_schema()
 
     def change_column_type(self, table_name, column_name, dtype):
         self.execute('PRAGMA journal_mode = OFF')
@@ -349,13 +982,30 @@ class Sq:
 
         self.execute(q)
 
-        q = "VACUUM"
-        log.info(f"{q}")
-        self.execute(q)
+        if self.db.execute('PRAGMA auto_vacuum').fetchone()[0] == 2:
+            self.reclaim()
+        else:
+            q = "VACUUM"
+            log.info(f"{q}")
+            self.execute(q)
 
     def rename_table(self, table_name, new_table_name):
         q = f'ALTER TABLE {table_name} RENAME TO {new_table_name};'
-        self.execute(q)
+        self.flush(True)
+        # an external-content FTS index can't be repointed, rebuild it
+        fts = self._drop_fts(table_name)
+        self.db.execute(q)
+        if self._has_counts():
+            self.db.execute(f"UPDATE {counts_table} SET name = ? "
+                            f"WHERE name = ?", (new_table_name, table_name))
+        self.db.commit()
+        if table_name in self._field_names:
+            self._field_names[new_table_name] = \
+                self._field_names.pop(table_name)
+            self.buffer[new_table_name] = self.buffer.pop(table_name)
+        self._sync_schema()
+        if fts is not None:
+            self.create_fts(new_table_name, **fts)
 
     def append(self, table, row):
         raise NotImplementedError("Method append")
@@ -375,67 +1025,463 @@ class Sq:
                 self.add_new_column(table_name=table, column_name=new_field)
 
         row_list = list()
-        log.debug(f"{self._field_names[table]}")
+        log.debug("%s", self._field_names[table])
         for field in self._field_names[table]:
             value = row.get(field, None)
 
             row_list.append(value)
-        log.debug(f"> {row_list}")
+        log.debug("> %s", row_list)
 
         self.buffer[table].append(row_list)
         if len(self.buffer[table]) > self.bulk_limit:
             self.flush(True)
 
-    def query_as_table(self, query, to_table):
-        self.executescript(f"DROP TABLE IF EXISTS [{to_table}];"
-                           f"CREATE TABLE [{to_table}] AS {query};")
+    def merge_from(self, paths, tables=None, on_schema_mismatch='union',
+                   on_conflict=None, dedup=False):
+        """Copy tables of other sqlite files into this one.
+
+        Each file is ATTACHed and copied with INSERT ... SELECT inside
+        sqlite. Missing tables are created from the source DDL. Columns
+        missing in the target are added (`on_schema_mismatch='union'`),
+        dropped from the copy ('ignore') or raise ValueError ('error').
+        `on_conflict` ('IGNORE' / 'REPLACE') applies to unique
+        constraints, `dedup=True` skips rows already present in the
+        target. Every file is merged in one transaction: an error leaves
+        none of its tables changed. Returns {table: rows copied}."""
+        if on_schema_mismatch not in ('union', 'ignore', 'error'):
+            raise ValueError(f"on_schema_mismatch: {on_schema_mismatch}")
+        if on_conflict is not None:
+            on_conflict = on_conflict.upper()
+            if on_conflict not in ('IGNORE', 'REPLACE'):
+                raise ValueError(f"on_conflict: {on_conflict}")
+        if isinstance(paths, (str, Path)):
+            paths = [paths]
+        self.flush(finalize=True)
+        result = dict()
+        for path in paths:
+            if not Path(path).exists():
+                raise IOError(f"No such file '{path}'")
+            self.db.execute("ATTACH DATABASE ? AS merge_src", (str(path),))
+            copied = dict()
+            try:
+                self.db.execute("BEGIN")
+                src_tables = [
+                    (name, sql) for name, sql in self.db.execute(
+                        "SELECT name, sql FROM merge_src.sqlite_master "
+                        "WHERE type = 'table'")
+                    if not name.startswith((meta_prefix, 'sqlite_'))
+                    and (tables is None or name in tables)]
+                for table, sql in tqdm(src_tables, desc=f'merge: {path}',
+                                       unit='table', disable=self.silent,
+                                       leave=False):
+                    copied[table] = self._merge_table(
+                        table, sql, on_schema_mismatch, on_conflict, dedup)
+                self._commit()
+            except BaseException:
+                self.db.rollback()
+                self._sync_schema()
+                raise
+            finally:
+                self.db.execute("DETACH DATABASE merge_src")
+            for table, n in copied.items():
+                result[table] = result.get(table, 0) + n
+        return result
 
-    def read_iter(self, table: str, it: typing.Iterable):
-        for row in it:
-            self.writerow(table=table, row=row)
+    def _merge_table(self, table, sql, on_schema_mismatch, on_conflict,
+                     dedup):
+        src_columns = [
+            (row[1], row[2]) for row in
+            self.db.execute(f"PRAGMA merge_src.table_info([{table}])")]
+
+        self.schema.check()
+        if table not in self.schema.tables():
+            self.db.execute(sql)
+            self._set_count(table, 0)
+            self.schema.check()
+        else:
+            target = self.schema.header(table)
+            missing = [(name, col_type) for name, col_type in src_columns
+                       if name not in target]
+            if missing and on_schema_mismatch == 'error':
+                raise ValueError(f"{table}: columns {missing} are missing")
+            if missing and on_schema_mismatch == 'union':
+                for name, col_type in missing:
+                    log.warning(f"{table}: add new column {name}")
+                    self.add_new_column(table, name, col_type or 'TEXT')
+        if table not in self._field_names:
+            self._field_names[table] = list()
+            self.buffer[table] = list()
+        self._sync_fields()
+
+        target = self.schema.header(table)
+        shared = [name for name, _ in src_columns if name in target]
+        if not shared:
+            return 0
+        columns = ','.join(f'"{name}"' for name in shared)
+        q = f"INSERT {f'OR {on_conflict} ' if on_conflict else ''}" \
+            f"INTO main.[{table}] ({columns}) " \
+            f"SELECT {columns} FROM merge_src.[{table}] AS s"
+        if dedup:
+            # not EXCEPT: its set semantics would also collapse duplicate
+            # rows within the source
+            match = ' AND '.join(f't."{name}" IS s."{name}"'
+                                 for name in shared)
+            q += f" WHERE NOT EXISTS (SELECT 1 FROM main.[{table}] AS t " \
+                 f"WHERE {match})"
+        log.debug(q)
+        c = self.db.execute(q)
+        if on_conflict == 'REPLACE':
+            # rowcount includes the replaced rows
+            self._set_count(table, None)
+        else:
+            self._add_count(table, c.rowcount)
+        return c.rowcount
+
+    def materialize(self, name, query, source, mode='incremental', key=None,
+                    aggregates=None):
+        """Keep table `name` equal to `query` over the table `source`.
+
+        The highest source rowid applied is kept in `_sq_watermarks`. In
+        'incremental' mode only source rows above it are run through
+        `query` (the source name resolves to a TEMP VIEW of the new rows)
+        and appended, which is right for filters/projections of an
+        append-only source. For aggregates give the group `key` columns
+        and `aggregates` {column: 'sum'|'count'|'min'|'max'} to merge new
+        groups into existing ones; every other column of the result must
+        be a key or in `aggregates` (ValueError otherwise, an AVG or the
+        like can't be merged and would go stale). Without `key`, queries
+        with GROUP BY, DISTINCT or aggregate functions are always rebuilt.
+        A 'full' rebuild (also used for the first run, a changed query or
+        a source that shrank) goes into a shadow table which replaces
+        `name` in one transaction.
+        Returns the number of rows inserted into `name`."""
+        if mode not in ('incremental', 'full'):
+            raise ValueError(f"mode: {mode}, expected 'incremental' or "
+                             f"'full'")
+        merge = {'sum': 'IFNULL(t.[{c}], 0) + IFNULL(d.[{c}], 0)',
+                 'count': 'IFNULL(t.[{c}], 0) + IFNULL(d.[{c}], 0)',
+                 'min': 'COALESCE(MIN(t.[{c}], d.[{c}]), t.[{c}], d.[{c}])',
+                 'max': 'COALESCE(MAX(t.[{c}], d.[{c}]), t.[{c}], d.[{c}])'}
+        aggregates = aggregates or dict()
+        for column, func in aggregates.items():
+            if func not in merge:
+                raise ValueError(f"{column}: aggregate {func} can't be "
+                                 f"merged, expected {list(merge)}")
+        if aggregates and not key:
+            raise ValueError("aggregates need the group `key` columns")
 
-    def read_csv(self, table, path, has_header=True, append=False,
-                 converter=None, count=None,
-                 csv_opts: dict = None, dtypes=None):
+        self.flush(finalize=True)
+        if key:
+            columns = [d[0] for d in self.db.execute(
+                f"SELECT * FROM ({query}) LIMIT 0").description]
+            unmerged = [c for c in columns
+                        if c not in key and c not in aggregates]
+            if unmerged:
+                raise ValueError(f"{name}: columns {unmerged} are neither "
+                                 f"in `key` nor in `aggregates`")
+        elif _aggregate_re.search(query):
+            # partial results of the new rows can't just be appended
+            mode = 'full'
+        self.db.execute(f"CREATE TABLE IF NOT EXISTS {watermarks_table} "
+                        f"(name TEXT PRIMARY KEY, source TEXT, "
+                        f"watermark INTEGER, spec TEXT)")
+        self.db.commit()
+        self.schema.check()
+        spec = json.dumps([query, source, key, aggregates])
+        last = self.db.execute(
+            f"SELECT watermark, spec FROM {watermarks_table} WHERE name = ?",
+            (name,)).fetchone()
+        hi = self.db.execute(
+            f"SELECT MAX(rowid) FROM [{source}]").fetchone()[0] or 0
+
+        if mode != 'full' and last is not None and last['spec'] == spec \
+                and name in self.schema.tables() and hi >= last['watermark']:
+            lo = last['watermark']
+            if hi == lo:
+                return 0
+            log.debug(f"materialize {name}: incremental ({lo}, {hi}]")
+        else:
+            lo = None
+            log.debug(f"materialize {name}: full, up to {hi}")
+
+        where = f"rowid <= {int(hi)}"
+        if lo is not None:
+            where += f" AND rowid > {int(lo)}"
+        # unqualified `source` in the query now means these rows only
+        self.db.execute(f"CREATE TEMP VIEW [{source}] AS "
+                        f"SELECT * FROM main.[{source}] WHERE {where}")
+        try:
+            if lo is None:
+                n = self._materialize_full(name, query, source, hi, spec)
+            else:
+                n = self._materialize_delta(name, query, source, hi, key,
+                                            {c: merge[f].format(c=c) for
+                                             c, f in aggregates.items()})
+        finally:
+            self.db.execute(f"DROP VIEW temp.[{source}]")
+        self._sync_schema()
+        return n
+
+    def _materialize_full(self, name, query, source, hi, spec):
+        shadow = f"{meta_prefix}shadow_{name}"
+        self.db.execute(f"DROP TABLE IF EXISTS main.[{shadow}]")
+        self.db.execute(f"CREATE TABLE main.[{shadow}] AS {query}")
+        n = self.db.execute(
+            f"SELECT COUNT(1) FROM main.[{shadow}]").fetchone()[0]
+        # readers see either the old or the new table, never none
+        self.db.execute("BEGIN")
+        try:
+            self.db.execute(f"DROP TABLE IF EXISTS main.[{name}]")
+            self.db.execute(f"ALTER TABLE main.[{shadow}] RENAME TO [{name}]")
+            self.db.execute(f"INSERT OR REPLACE INTO {watermarks_table} "
+                            f"(name, source, watermark, spec) "
+                            f"VALUES (?, ?, ?, ?)", (name, source, hi, spec))
+            self._set_count(name, n)
+            self.db.commit()
+        except Exception:
+            self.db.rollback()
+            raise
+        return n
+
+    def _materialize_delta(self, name, query, source, hi, key, merges):
+        self.db.execute("BEGIN")
+        try:
+            if not merges:
+                c = self.db.execute(
+                    f"INSERT INTO main.[{name}] SELECT * FROM ({query})")
+            else:
+                self.db.execute(f"CREATE TEMP TABLE {meta_prefix}delta "
+                                f"AS {query}")
+                match = ' AND '.join(f"t.[{k}] IS d.[{k}]" for k in key)
+                sets = ', '.join(f"[{c}] = {expr}"
+                                 for c, expr in merges.items())
+                self.db.execute(f"UPDATE main.[{name}] AS t SET {sets} "
+                                f"FROM temp.{meta_prefix}delta AS d "
+                                f"WHERE {match}")
+                c = self.db.execute(
+                    f"INSERT INTO main.[{name}] "
+                    f"SELECT * FROM temp.{meta_prefix}delta AS d WHERE NOT "
+                    f"EXISTS (SELECT 1 FROM main.[{name}] AS t "
+                    f"WHERE {match})")
+                self.db.execute(f"DROP TABLE temp.{meta_prefix}delta")
+            self._add_count(name, c.rowcount)
+            self.db.execute(f"UPDATE {watermarks_table} SET watermark = ? "
+                            f"WHERE name = ?", (hi, name))
+            self.db.commit()
+        except Exception:
+            self.db.rollback()
+            raise
+        return c.rowcount
 
-        if not path or not Path(path).exists():
-            raise IOError(f"No such file '{path}'")
+    def query_as_table(self, query, to_table):
+        self.flush(True)
+        self.db.executescript(f"DROP TABLE IF EXISTS [{to_table}];"
+                              f"CREATE TABLE [{to_table}] AS {query};")
+        self._set_count(to_table, None)
+        self.db.commit()
+        self._sync_schema()
+
+    def read_iter(self, table: str, it: typing.Iterable, checkpoint=False,
+                  resume=False, source=None):
+        """writerow() every dict of `it`.
+
+        With `checkpoint` the number of committed rows is recorded with
+        every flush; `resume=True` skips that many rows of `it` (which must
+        yield the same rows again, identified by `source`)."""
+        if not (checkpoint or resume):
+            for row in it:
+                self.writerow(table=table, row=row)
+            return
+
+        cp = self._start_checkpoint(table, source or table, resume)
+        it = iter(it)
+        if cp['resumed']:
+            next(itertools.islice(it, cp['rows'], cp['rows']), None)
+            if table not in self._field_names:
+                self.create_table(name=table, append=True,
+                                  header=self.table_columns(table))
+        try:
+            for row in it:
+                # flush before, never inside writerow, so the checkpoint
+                # always matches the committed rows
+                if len(self.buffer.get(table, ())) >= self.bulk_limit:
+                    self.flush(True)
+                self.writerow(table=table, row=row)
+                cp['rows'] += 1
+                cp['position'] = cp['rows']
+        finally:
+            self._end_checkpoint(table)
 
+    def read_csv(self, table, path, has_header=True, append=False,
+                 converter=None, count=None,
+                 csv_opts: dict = None, dtypes=None,
+                 checkpoint=False, resume=False):
+        """Load a csv file (path, '-' or file object, optionally gz/bz2/xz).
+
+        With `checkpoint` the byte offset (row index for compressed or
+        piped input) after the last committed row is recorded in the same
+        transaction as every flush. `resume=True` continues a load from
+        its checkpoint, if the source file is unchanged."""
         if not csv_opts:
             csv_opts = dict()
-        with open(path) as f:
-            total_lines = None
-            if not self.silent:
-                if count is None:
-                    total_lines = count_lines(path)
-                else:
-                    total_lines = count
-                f.seek(0)
-
-            # c = csv.DictReader(f)
-            header = csv_opts.pop('fieldnames', [])
-            c = csv.reader(f, **csv_opts)
-            if has_header:
-                header = next(c)
+
+        cp = None
+        if checkpoint or resume:
+            cp = self._start_checkpoint(table, _source_id(path), resume)
+        resumed = cp is not None and cp['resumed']
+        # byte offsets for plain files, seek on resume
+        by_offset = cp is not None and _is_plain_file(path)
+
+        try:
+            with (open(path, 'rb') if by_offset else open_input(path)) as f:
+                total_lines = None
+                if not self.silent:
+                    if count is not None:
+                        total_lines = count
+                    elif _is_plain_file(path):
+                        total_lines = count_lines(path)
+
+                lines = _OffsetLines(f) if by_offset else f
+                # c = csv.DictReader(f)
+                header = csv_opts.pop('fieldnames', [])
+                c = csv.reader(lines, **csv_opts)
+                first = None
+                if has_header:
+                    header = next(c)
+                elif not header:
+                    first = next(c)
+                    header = [f"col{i}" for i in range(len(first))]
                 self.create_table(name=table, header=header,
-                                  append=append, dtypes=dtypes)
-            else:
-                if not header:
-                    row = [f"col{i}" for i in enumerate(list(next(c)))]
-                    header = [f"col{i}" for i in enumerate(row)]
+                                  append=append or resumed, dtypes=dtypes)
+
+                rows = c
+                if resumed:
+                    if by_offset:
+                        lines.seek(cp['position'])
+                    else:
+                        skip = cp['rows'] - (first is not None)
+                        next(itertools.islice(c, skip, skip), None)
+                elif first is not None:
+                    rows = itertools.chain([first], c)
+
+                for row in tqdm(rows, total=total_lines,
+                                desc=f'load: {path}', unit='row',
+                                disable=self.silent, leave=False):
+
+                    if converter:
+                        converter(row)
+                    if cp is None:
+                        self.write(table, row)
+                        continue
+                    # flush before, never inside write, so the checkpoint
+                    # always matches the committed rows
+                    if len(self.buffer[table]) >= self.bulk_limit:
+                        self.flush(True)
                     self.write(table, row)
-                self.create_table(name=table, header=header,
-                                  append=append, dtypes=dtypes)
-            for row in tqdm(c, total=total_lines, desc=f'load: {path}',
-                            unit='row', disable=self.silent,
-                            leave=False):
-
-                if converter:
-                    converter(row)
-                # self.writerow(table, row)
-                self.write(table, row)
+                    cp['rows'] += 1
+                    cp['position'] = \
+                        lines.offset if by_offset else cp['rows']
+        finally:
+            if cp is not None:
+                self._end_checkpoint(table)
         self.flush(finalize=True)
 
+    def checkpoint(self, table):
+        """Last committed checkpoint of `table`: {source, position, rows}"""
+        if checkpoints_table not in self.schema.tables():
+            return None
+        row = self.db.execute(
+            f"SELECT source, position, rows FROM {checkpoints_table} "
+            f"WHERE name = ?", (table,)).fetchone()
+        return dict(row) if row else None
+
+    def _start_checkpoint(self, table, source, resume):
+        self.flush(finalize=True)
+        self.db.execute(f"CREATE TABLE IF NOT EXISTS {checkpoints_table} "
+                        f"(name TEXT PRIMARY KEY, source TEXT, "
+                        f"position INTEGER, rows INTEGER)")
+        self.schema.check()
+        last = self.checkpoint(table)
+        if resume and last and table in self.tables():
+            if last['source'] != source:
+                raise ValueError(f"{table}: checkpoint is for other source "
+                                 f"'{last['source']}', not '{source}'")
+            log.info(f"{table}: resume from {last}")
+            cp = dict(last, resumed=True)
+        else:
+            cp = dict(source=source, position=0, rows=0, resumed=False)
+            self.db.execute(f"INSERT OR REPLACE INTO {checkpoints_table} "
+                            f"(name, source, position, rows) "
+                            f"VALUES (?, ?, 0, 0)", (table, source))
+        self.db.commit()
+        self._checkpoints[table] = cp
+        return cp
+
+    def _end_checkpoint(self, table):
+        """Commit what is buffered with its checkpoint, also on errors"""
+        try:
+            self.flush(finalize=True)
+        finally:
+            self._checkpoints.pop(table, None)
+
+    def _save_checkpoint(self, table):
+        """Record the progress of an ingest into `table`. Caller commits."""
+        cp = self._checkpoints.get(table)
+        if cp is not None:
+            self.db.execute(f"UPDATE {checkpoints_table} "
+                            f"SET position = ?, rows = ? WHERE name = ?",
+                            (cp['position'], cp['rows'], table))
+
+    def read_jsonl(self, table, path, flatten='.', max_depth=None,
+                   append=False, batch_size=None):
+        """Load a JSON Lines file, one object per line.
+
+        Nested objects are flattened into `parent<flatten>child` columns
+        (`flatten=None` keeps them as JSON strings). Lines are decoded
+        `batch_size` (default: bulk_limit) at a time and columns missing
+        from the table are added once per batch. Like `read_csv`, the
+        table is replaced unless `append`."""
+        if batch_size is None:
+            batch_size = self.bulk_limit
+
+        with open_input(path, newline=None) as f:
+            batch = list()
+            create = True
+            for line in tqdm(f, desc=f'load: {path}', unit='row',
+                             disable=self.silent, leave=False):
+                if line.strip():
+                    batch.append(line)
+                if len(batch) >= batch_size:
+                    self._write_json_batch(table, batch, flatten, max_depth,
+                                           append, create)
+                    batch = list()
+                    create = False
+            if batch:
+                self._write_json_batch(table, batch, flatten, max_depth,
+                                       append, create)
+        self.flush(finalize=True)
+
+    def _write_json_batch(self, table, lines, flatten, max_depth, append,
+                          create):
+        objs = [json.loads(line) for line in lines]
+        rows = list()
+        for obj in objs:
+            if not isinstance(obj, dict):
+                raise ValueError(f"JSON object expected, got: {obj!r}")
+            rows.append(_flatten(obj, flatten, max_depth))
+
+        keys = list(dict.fromkeys(key for row in rows for key in row))
+        if create:
+            self.create_table(name=table, header=keys, append=append)
+        known = set(self._field_names[table])
+        for key in keys:
+            if key not in known:
+                self.add_new_column(table_name=table, column_name=key)
+
+        fields = self._field_names[table]
+        for row in rows:
+            self.write(table, [row.get(field) for field in fields])
+
     def write(self, table, values):
         self.buffer[table].append(values)
         if len(self.buffer[table]) > self.bulk_limit:
@@ -466,27 +1512,495 @@ class Sq:
         for row in c:
             yield dict(row)
 
+    def to_csv(self, source, path, header=True, compress=None, parts=None,
+               batch_size=10000, csv_opts: dict = None):
+        """Export a table or a SELECT query to csv, returns rows written.
+
+        Rows are streamed in `fetchmany` batches of tuples straight into
+        `csv.writer.writerows`. `compress` gzips the output (default: by
+        *.gz suffix). With `parts=N` a table is split into N rowid ranges
+        exported in parallel to out-00000.csv, out-00001.csv, ...
+        BLOB values are written base64 encoded, as in `to_jsonl`."""
+        return self._export(source, path, 'csv', header=header,
+                            compress=compress, parts=parts,
+                            batch_size=batch_size, csv_opts=csv_opts)
+
+    def to_jsonl(self, source, path, compress=None, parts=None,
+                 batch_size=10000):
+        """Export a table or a SELECT query as JSON Lines, see `to_csv`.
+        BLOB values are written base64 encoded."""
+        return self._export(source, path, 'jsonl', compress=compress,
+                            parts=parts, batch_size=batch_size)
+
+    def _export(self, source, path, fmt, parts=None, **opts):
+        self.flush(finalize=True)
+        is_query = re.match(r"^\s*(SELECT|WITH)\b", source, re.IGNORECASE)
+        # progress bar size only: no COUNT(1) scan, no _sq_counts writes
+        total = None if is_query or self.silent \
+            else self.counts(source, approx=True)
+
+        with tqdm(total=total, desc=f'export: {path}', unit='row',
+                  disable=self.silent, leave=False) as bar:
+            if not parts or parts <= 1:
+                query = source if is_query else f"SELECT * FROM [{source}]"
+                return _export_rows(self.db, query, (), path, fmt,
+                                    bar=bar, **opts)
+
+            if is_query:
+                raise ValueError("parts are supported for tables only")
+            lo, hi = self.db.execute(
+                f"SELECT MIN(rowid), MAX(rowid) FROM [{source}]").fetchone()
+            lo, hi = lo or 0, hi or 0
+            step = (hi - lo) // parts + 1
+            query = f"SELECT * FROM [{source}] WHERE rowid BETWEEN ? AND ?"
+            jobs = [(query, (lo + i * step, lo + (i + 1) * step - 1),
+                     _part_path(path, i)) for i in range(parts)]
+
+            if self._db_path == ':memory:':
+                return sum(_export_rows(self.db, q, params, part_path, fmt,
+                                        bar=bar, **opts)
+                           for q, params, part_path in jobs)
+
+            uri = Path(self._db_path).absolute().as_uri() + '?mode=ro'
+
+            def _job(q, params, part_path):
+                db = sqlite3.connect(uri, uri=True, check_same_thread=False)
+                try:
+                    return _export_rows(db, q, params, part_path, fmt,
+                                        bar=bar, **opts)
+                finally:
+                    db.close()
+
+            with ThreadPoolExecutor(max_workers=parts) as pool:
+                return sum(pool.map(lambda job: _job(*job), jobs))
+
     def select_random_row(self, table, where=''):
+        rows = self._sample(table, 1, where or None, None, 0.5)
+        return rows[0] if rows else None
+
+    def sample(self, table, n, where=None, seed=None, min_density=0.5):
+        """Return up to `n` random rows of `table` as dicts.
+
+        Without `where` the rows are fetched by probing random rowids in
+        [min(rowid), max(rowid)], which touches only the sampled pages.
+        If the rowids turn out to be sparse (hit rate below `min_density`)
+        or a `where` filter is given, a sample of the (filtered) rowids is
+        taken instead and the chosen rows are fetched by rowid.
+        With `seed` the sample is reproducible."""
+        return [dict(row) for row in
+                self._sample(table, n, where, seed, min_density)]
+
+    def _sample(self, table, n, where, seed, min_density):
+        """sqlite3.Row results of sample()"""
         self.flush(finalize=True)
-        row = self.db.execute(f"SELECT * FROM [{table}]"
-                              f"WHERE {where} "
-                              f"ORDER BY RANDOM() LIMIT 1").fetchone()
-        return row
+        rnd = random.Random(seed)
+        if n <= 0:
+            return list()
+        if where:
+            return self._fetch_rowids(
+                table, self._sample_rowids(table, n, where, rnd, seed), rnd)
+
+        lo, hi = self.db.execute(
+            f"SELECT MIN(rowid), MAX(rowid) FROM [{table}]").fetchone()
+        if lo is None:
+            return list()
+        span = hi - lo + 1
+        if span <= n:
+            rows = self.db.execute(f"SELECT * FROM [{table}]").fetchall()
+            rnd.shuffle(rows)
+            return rows
+
+        rows = self._probe_sample(table, n, lo, hi, rnd, min_density)
+        if rows is None:
+            log.debug(f"{table}: sparse rowids, reservoir sample")
+            return self._fetch_rowids(
+                table, self._sample_rowids(table, n, None, rnd, seed), rnd)
+        return rows
+
+    def _probe_sample(self, table, n, lo, hi, rnd, min_density,
+                      chunk_size=500):
+        span = hi - lo + 1
+        tried = set()
+        rows = list()
+        while len(rows) < n and len(tried) < span:
+            want = min(2 * (n - len(rows)), span - len(tried))
+            if not tried:
+                candidates = rnd.sample(range(lo, hi + 1), want)
+            else:
+                candidates = set()
+                while len(candidates) < want:
+                    rowid = rnd.randint(lo, hi)
+                    if rowid not in tried:
+                        candidates.add(rowid)
+                candidates = list(candidates)
+            tried.update(candidates)
+            rows.extend(self._fetch_rowids(table, candidates,
+                                           chunk_size=chunk_size))
+
+            if len(rows) < min_density * len(tried):
+                return None
+
+        rnd.shuffle(rows)
+        return rows[:n]
+
+    def _fetch_rowids(self, table, rowids, rnd=None, chunk_size=500):
+        """Rows with the given rowids (shuffled with `rnd`)"""
+        rows = list()
+        for i in range(0, len(rowids), chunk_size):
+            chunk = rowids[i:i + chunk_size]
+            tags = ','.join('?' for _ in chunk)
+            rows.extend(self.db.execute(
+                f"SELECT * FROM [{table}] WHERE rowid IN ({tags})", chunk))
+        if rnd is not None:
+            rnd.shuffle(rows)
+        return rows
+
+    def _sample_rowids(self, table, n, where, rnd, seed):
+        """Rowids of a uniform sample of `n` (filtered) rows.
+
+        Unseeded, sqlite picks them with ORDER BY RANDOM() LIMIT n over
+        the rowids only. RANDOM() can not be seeded, so with `seed` a
+        reservoir (Algorithm L) is kept instead: the number of rows to skip
+        between replacements is drawn directly and skipped by islice, so
+        there is no random number per row."""
+        q = f"SELECT rowid FROM [{table}]"
+        if where:
+            q += f" WHERE {where}"
+        if seed is None:
+            return [row[0] for row in
+                    self.db.execute(f"{q} ORDER BY RANDOM() LIMIT ?", (n,))]
+
+        c = self.db.cursor()
+        c.row_factory = None
+        c.execute(q)
+        reservoir = [row[0] for row in itertools.islice(c, n)]
+        if len(reservoir) < n:
+            return reservoir
+
+        def _u():  # uniform in (0, 1)
+            return rnd.random() or 0.5
+
+        w = math.exp(math.log(_u()) / n)
+        while True:
+            skip = int(math.log(_u()) / math.log1p(-w)) if w < 1 else 0
+            row = next(itertools.islice(c, skip, None), None)
+            if row is None:
+                return reservoir
+            reservoir[rnd.randrange(n)] = row[0]
+            w *= math.exp(math.log(_u()) / n)
+
+    def delete_where(self, table, where, params=(), batch=10000):
+        """DELETE FROM `table` WHERE `where` in chunks of `batch` rows.
+
+        Every chunk is bounded by a rowid range and committed on its own,
+        so the write lock is held only briefly and readers get in between.
+        Returns the number of deleted rows."""
+        self.flush(finalize=True)
+        select = f"SELECT rowid FROM [{table}] " \
+                 f"WHERE rowid > ? AND ({where}) ORDER BY rowid LIMIT ?"
+        delete = f"DELETE FROM [{table}] " \
+                 f"WHERE rowid BETWEEN ? AND ? AND ({where})"
+        deleted = 0
+        last = None
+        with tqdm(desc=f'delete: {table}', unit='row', disable=self.silent,
+                  leave=False) as bar:
+            while True:
+                ids = self.db.execute(
+                    select, (-2 ** 63 if last is None else last, *params,
+                             batch)).fetchall()
+                if not ids:
+                    break
+                first, last = ids[0][0], ids[-1][0]
+                c = self.db.execute(delete, (first, last, *params))
+                self._add_count(table, -c.rowcount)
+                self.db.commit()
+                deleted += c.rowcount
+                bar.update(c.rowcount)
+        log.debug(f"{table}: deleted {deleted}")
+        return deleted
+
+    def reclaim(self, max_pages=None):
+        """Give free pages back to the file system with
+        `PRAGMA incremental_vacuum`, at most `max_pages` at a time.
+        Needs `auto_vacuum='INCREMENTAL'`. Returns the pages released."""
+        self.flush(finalize=True)
+        if self.db.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+            log.warning("reclaim: auto_vacuum is not INCREMENTAL")
+            return 0
+        free = self.db.execute('PRAGMA freelist_count').fetchone()[0]
+        q = 'PRAGMA incremental_vacuum' if max_pages is None \
+            else f'PRAGMA incremental_vacuum({int(max_pages)})'
+        # execute() steps a pragma without result columns only once,
+        # which frees a single page
+        self.db.executescript(q)
+        return free - self.db.execute('PRAGMA freelist_count').fetchone()[0]
+
+    def create_fts(self, table, columns, tokenizer='unicode61',
+                   sync='triggers'):
+        """Build an FTS5 full-text index over text `columns` of `table`.
+
+        The index is an external-content table (the text is not copied)
+        built in bulk with 'rebuild'. It is kept in sync by triggers
+        (`sync='triggers'`), or, for append-only tables, by indexing the
+        rows appended by each flush (`sync='flush'`). See `search`."""
+        if sync not in ('triggers', 'flush'):
+            raise ValueError(f"sync: {sync}, expected 'triggers' or 'flush'")
+        self.flush(finalize=True)
+        fts = f"{fts_table}_{table}"
+        cols = ', '.join(f'"{c}"' for c in columns)
+        new = ', '.join(f'new."{c}"' for c in columns)
+        old = ', '.join(f'old."{c}"' for c in columns)
+        tokenizer = tokenizer.replace("'", "''")
+
+        self.db.execute("BEGIN")
+        try:
+            self.db.execute(f"DROP TABLE IF EXISTS [{fts}]")
+            for op in ('ai', 'ad', 'au'):
+                self.db.execute(f"DROP TRIGGER IF EXISTS [{fts}_{op}]")
+            self.db.execute(
+                f"CREATE VIRTUAL TABLE [{fts}] USING fts5({cols}, "
+                f"content='{table}', content_rowid='rowid', "
+                f"tokenize='{tokenizer}')")
+            self.db.execute(f"INSERT INTO [{fts}]([{fts}]) VALUES('rebuild')")
+            if sync == 'triggers':
+                delete = f"INSERT INTO [{fts}]([{fts}], rowid, {cols}) " \
+                         f"VALUES('delete', old.rowid, {old});"
+                insert = f"INSERT INTO [{fts}](rowid, {cols}) " \
+                         f"VALUES(new.rowid, {new});"
+                self.db.execute(f"CREATE TRIGGER [{fts}_ai] AFTER INSERT "
+                                f"ON [{table}] BEGIN {insert} END")
+                self.db.execute(f"CREATE TRIGGER [{fts}_ad] AFTER DELETE "
+                                f"ON [{table}] BEGIN {delete} END")
+                self.db.execute(f"CREATE TRIGGER [{fts}_au] AFTER UPDATE "
+                                f"ON [{table}] BEGIN {delete} {insert} END")
+            self.db.execute(f"CREATE TABLE IF NOT EXISTS {fts_table} "
+                            f"(name TEXT PRIMARY KEY, columns TEXT, "
+                            f"sync TEXT, watermark INTEGER)")
+            self.db.execute(
+                f"INSERT OR REPLACE INTO {fts_table} "
+                f"(name, columns, sync, watermark) "
+                f"VALUES (?, ?, ?, (SELECT MAX(rowid) FROM [{table}]))",
+                (table, json.dumps(list(columns)), sync))
+            self.db.commit()
+        except Exception:
+            self.db.rollback()
+            raise
+        self._fts_flush = None
+        self._sync_schema()
+
+    def search(self, table, query, limit=10):
+        """Rows of `table` matching the FTS5 `query`, best bm25 first"""
+        self.flush(finalize=True)
+        fts = f"{fts_table}_{table}"
+        # fts5 rank is bm25()
+        q = f"SELECT t.* FROM [{fts}] JOIN [{table}] AS t " \
+            f"ON t.rowid = [{fts}].rowid " \
+            f"WHERE [{fts}] MATCH ? ORDER BY [{fts}].rank LIMIT ?"
+        return [dict(row) for row in self.db.execute(q, (query, limit))]
+
+    def _sync_fts(self, table):
+        """Index rows appended to `table` for sync='flush'. Caller commits."""
+        if self._fts_flush is None:
+            self._fts_flush = dict()
+            if fts_table in self.schema.tables():
+                for name, columns, watermark in self.db.execute(
+                        f"SELECT name, columns, watermark FROM {fts_table} "
+                        f"WHERE sync = 'flush'"):
+                    self._fts_flush[name] = [json.loads(columns), watermark]
+        if table not in self._fts_flush:
+            return
+        columns, watermark = self._fts_flush[table]
+        fts = f"{fts_table}_{table}"
+        cols = ', '.join(f'"{c}"' for c in columns)
+        self.db.execute(f"INSERT INTO [{fts}](rowid, {cols}) "
+                        f"SELECT rowid, {cols} FROM [{table}] "
+                        f"WHERE rowid > ?", (watermark or 0,))
+        watermark = self.db.execute(
+            f"SELECT MAX(rowid) FROM [{table}]").fetchone()[0]
+        self.db.execute(f"UPDATE {fts_table} SET watermark = ? "
+                        f"WHERE name = ?", (watermark, table))
+        self._fts_flush[table][1] = watermark
+
+    def _drop_fts(self, table):
+        """Drop the FTS index of `table` with its triggers, returns its
+        create_fts() arguments or None. Caller commits."""
+        if fts_table not in self.schema.tables():
+            return None
+        row = self.db.execute(f"SELECT columns, sync FROM {fts_table} "
+                              f"WHERE name = ?", (table,)).fetchone()
+        fts = f"{fts_table}_{table}"
+        sql = self.db.execute("SELECT sql FROM sqlite_master WHERE name = ?",
+                              (fts,)).fetchone()
+        self.db.execute(f"DROP TABLE IF EXISTS [{fts}]")
+        for op in ('ai', 'ad', 'au'):
+            self.db.execute(f"DROP TRIGGER IF EXISTS [{fts}_{op}]")
+        self.db.execute(f"DELETE FROM {fts_table} WHERE name = ?", (table,))
+        self._fts_flush = None
+        if row is None:
+            return None
+        tokenizer = re.search(r"tokenize='((?:[^']|'')*)'", sql[0]) \
+            if sql else None
+        return dict(columns=json.loads(row['columns']), sync=row['sync'],
+                    tokenizer=tokenizer.group(1).replace("''", "'")
+                    if tokenizer else 'unicode61')
 
     def drop(self, table):
         self.flush(finalize=True)
         self.db.execute(f"DROP TABLE IF EXISTS {table}")
+        self._set_count(table, None)
+        self._drop_fts(table)
         self.db.commit()
+        self._sync_schema()
+
+    def counts(self, table=None, approx=False, refresh=False):
+        """Row counts of `table` or of all tables as {table: count}.
+
+        Counts are maintained in the `_sq_counts` table on every write
+        done through Sq, so they are read without scanning. Tables
+        without a maintained count are counted with COUNT(1), or, with
+        `approx=True`, estimated from sqlite_stat1 (see ANALYZE) or the
+        rowid range. `refresh=True` recounts every table.
+
+        A fresh count is stored (and maintained from then on) only in a
+        file that already has `_sq_counts`, so inspecting a foreign or
+        read-only file writes nothing."""
+        self.flush(finalize=True)
+        tables = self.tables() if table is None else [table]
+        known = dict() if refresh else self._maintained_counts()
 
-    def counts(self, table=None):
-        if table is not None:
-            return self.db.execute(
-                f"SELECT COUNT(1) as cnt FROM [{table}]").fetchone()['cnt']
         result = dict()
-        for table in self.tables():
-            c = self.db.execute(
-                f"SELECT COUNT(1) as cnt FROM [{table}]").fetchone()['cnt']
-            result[table] = c
+        counted = dict()
+        for name in tables:
+            if name in known:
+                result[name] = known[name]
+            elif approx:
+                result[name] = self._estimate_count(name)
+            else:
+                result[name] = counted[name] = self.db.execute(
+                    f"SELECT COUNT(1) as cnt FROM [{name}]").fetchone()['cnt']
+        if counted and self._has_counts():
+            try:
+                for name, cnt in counted.items():
+                    self._set_count(name, cnt)
+                self.db.commit()
+            except sqlite3.OperationalError as e:  # e.g. read-only
+                log.debug(f"counts not stored: {e}")
+                self.db.rollback()
+
+        if table is not None:
+            return result[table]
+        return result
+
+    def _has_counts(self):
+        return counts_table in self.schema.tables()
+
+    def _maintained_counts(self):
+        if not self._has_counts():
+            return dict()
+        return dict(self.db.execute(f"SELECT name, cnt FROM {counts_table}"
+                                    ).fetchall())
+
+    def _set_count(self, table, cnt):
+        """Store an exact count, `None` forgets it. Caller commits."""
+        if cnt is None:
+            if self._has_counts():
+                self.db.execute(f"DELETE FROM {counts_table} WHERE name = ?",
+                                (table,))
+            return
+        if not self._has_counts():
+            self.db.execute(f"CREATE TABLE IF NOT EXISTS {counts_table} "
+                            f"(name TEXT PRIMARY KEY, cnt INTEGER NOT NULL)")
+            self.schema.check()
+        self.db.execute(f"INSERT OR REPLACE INTO {counts_table} (name, cnt) "
+                        f"VALUES (?, ?)", (table, cnt))
+
+    def _add_count(self, table, delta):
+        """Shift a maintained count by `delta`. Caller commits."""
+        if delta and self._has_counts():
+            self.db.execute(f"UPDATE {counts_table} SET cnt = cnt + ? "
+                            f"WHERE name = ?", (delta, table))
+
+    def _track_counts(self, q, rowcount=-1):
+        """Keep maintained counts right after a single SQL statement `q`."""
+        if not self._has_counts() or _no_count_re.match(q):
+            return
+        m = _dml_count_re.match(q)
+        # an upsert's rowcount includes the updated rows
+        if m and rowcount >= 0 and not _upsert_re.search(q):
+            verb, schema, table = m.groups()
+            table = _unquote(table)
+            if (schema is None or _unquote(schema).lower() == 'main') \
+                    and table in self._maintained_counts():
+                sign = -1 if verb.upper().startswith('DELETE') else 1
+                self._add_count(table, sign * rowcount)
+                return
+        self._forget_counts(q)
+
+    def _forget_counts(self, q):
+        """Unknown effect of `q`: forget the counts of every table
+        mentioned in it, they are recounted when asked for."""
+        if not self._has_counts():
+            return
+        for name in self._maintained_counts():
+            if re.search(rf"(?<!\w){re.escape(name)}(?!\w)", q):
+                self._set_count(name, None)
+
+    def _estimate_count(self, table):
+        has_stat = self.db.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'"
+        ).fetchone()
+        if has_stat:
+            row = self.db.execute(
+                "SELECT stat FROM sqlite_stat1 WHERE tbl = ? "
+                "ORDER BY idx IS NOT NULL LIMIT 1", (table,)).fetchone()
+            if row:
+                return int(row[0].split()[0])
+        lo, hi = self.db.execute(
+            f"SELECT MIN(rowid), MAX(rowid) FROM [{table}]").fetchone()
+        return 0 if lo is None else hi - lo + 1
+
+    def profile(self, table, columns=None, parts=None, batch_size=10000,
+                top_k=10):
+        """{column: stats} from one streaming scan of `table`.
+
+        Stats are count, nulls, min, max, storage types, the inferred type
+        (TEXT holding only numbers is INTEGER/REAL), distinct (HyperLogLog
+        estimate, exact for few distinct values) and the `top_k` frequent
+        values (Misra-Gries). `parts=N` scans N rowid ranges in worker
+        processes and merges the sketches. Results are cached until the
+        database changes (PRAGMA data_version, own changes and schema)."""
+        self.flush(finalize=True)
+        if columns is None:
+            columns = self.table_columns(table)
+        version = (self.db.execute('PRAGMA data_version').fetchone()[0],
+                   self.db.total_changes, self.schema.version)
+        key = (table, tuple(columns), top_k)
+        if key in self._profiles and self._profiles[key][0] == version:
+            return self._profiles[key][1]
+
+        if not parts or parts <= 1 or self._db_path == ':memory:':
+            profiles = _profile_rows(self.db, table, columns,
+                                     batch_size=batch_size, top_k=top_k)
+        else:
+            lo, hi = self.db.execute(
+                f"SELECT MIN(rowid), MAX(rowid) FROM [{table}]").fetchone()
+            lo, hi = lo or 0, hi or 0
+            step = (hi - lo) // parts + 1
+            uri = Path(self._db_path).absolute().as_uri() + '?mode=ro'
+            with ProcessPoolExecutor(max_workers=parts) as pool:
+                futures = [
+                    pool.submit(_profile_part, uri, table, columns,
+                                lo + i * step, lo + (i + 1) * step - 1,
+                                batch_size, top_k)
+                    for i in range(parts)]
+                profiles = futures[0].result()
+                for future in futures[1:]:
+                    for profile, other in zip(profiles, future.result()):
+                        profile.merge(other)
+
+        result = {column: profile.result()
+                  for column, profile in zip(columns, profiles)}
+        self._profiles[key] = (version, result)
         return result
 
     def head(self, table, n=5):
@@ -1,5 +1,12 @@
+import bz2
+import csv
+import gzip
+import json
 import logging
+import lzma
+import zlib
 from sqlfile import Sq
+from sqlfile.sqlfile import open_input, _DecompressReader
 from itertools import zip_longest
 log = logging.getLogger('sql_storage')
 
@@ -20,5 +27,639 @@ def test_read_iter():
             assert row1 == row2
 
 
+def test_sample():
+    with Sq(':memory:') as sq:
+        sq.read_iter('x', ({'a': i, 'b': i % 3} for i in range(1000)))
+
+        rows = sq.sample('x', 10, seed=1)
+        assert len(rows) == 10
+        assert len({row['a'] for row in rows}) == 10
+        assert rows == sq.sample('x', 10, seed=1)
+
+        rows = sq.sample('x', 10, where="b = '1'", seed=1)
+        assert len(rows) == 10
+        assert all(row['b'] == '1' for row in rows)
+
+        assert len(sq.sample('x', 2000)) == 1000
+
+        # sparse rowids -> reservoir fallback
+        sq.execute("DELETE FROM x WHERE rowid % 10 != 0")
+        rows = sq.sample('x', 20, seed=2)
+        assert len(rows) == 20
+        assert all(int(row['a']) % 10 == 9 for row in rows)
+
+        assert sq.select_random_row('x', where="a = '9'")['a'] == '9'
+        assert sq.select_random_row('x', where="a = '9'")[0] == '9'
+        assert sq.select_random_row('x', where="a = 'none'") is None
+
+
+def test_counts(tmp_path):
+    with Sq(':memory:', bulk_limit=7) as sq:
+        sq.read_iter('x', ({'a': i} for i in range(100)))
+        sq.read_iter('y', ({'a': i} for i in range(10)))
+        assert sq.counts() == {'x': 100, 'y': 10}
+
+        sq.execute("DELETE FROM x WHERE rowid <= 30")
+        sq.rename_table('y', 'z')
+        assert sq.counts() == {'x': 70, 'z': 10}
+        assert sq.db.execute(
+            "SELECT cnt FROM _sq_counts WHERE name = 'x'").fetchone()[0] == 70
+
+        # untracked table: counted once, then maintained
+        sq.db.execute("CREATE TABLE raw (a)")
+        sq.db.executemany("INSERT INTO raw VALUES (?)", [(i,) for i in range(5)])
+        assert sq.counts('raw', approx=True) == 5
+        assert sq.counts('raw') == 5
+        sq.execute("INSERT INTO raw VALUES (5)")
+        assert sq.counts('raw') == 6
+
+        sq.query_as_table("SELECT * FROM x WHERE rowid <= 50", 'q')
+        assert sq.counts('q') == 20
+
+        sq.drop('x')
+        assert sq.counts() == {'z': 10, 'raw': 6, 'q': 20}
+
+        # qualified / quoted names, scripts, REPLACE
+        sq.read_iter('a b', ({'a': i} for i in range(10)))
+        sq.execute("DELETE FROM main.q WHERE rowid <= 5")
+        sq.execute('DELETE FROM "a b" WHERE rowid <= 2')
+        assert sq.counts('q') == 15 and sq.counts('a b') == 8
+        sq.executescript("PRAGMA cache_size = 100; DELETE FROM raw "
+                         "WHERE rowid <= 3")
+        assert sq.counts('raw') == 3
+        sq.execute("INSERT OR REPLACE INTO raw (rowid, a) VALUES (4, 0)")
+        assert sq.counts('raw') == 3
+        sq.execute("CREATE UNIQUE INDEX raw_a ON raw (a)")
+        sq.execute("INSERT INTO raw (a) VALUES (0), (100) "
+                   "ON CONFLICT (a) DO UPDATE SET a = a + 1000")
+        assert sq.counts('raw') == 4
+
+    # a foreign / read-only file is only read
+    import sqlite3
+    foreign = str(tmp_path / 'foreign.sqlite')
+    db = sqlite3.connect(foreign)
+    db.execute("CREATE TABLE f (a)")
+    db.execute("INSERT INTO f VALUES (1)")
+    db.commit()
+    db.close()
+    with Sq(foreign, append=True) as sq:
+        assert sq.counts() == {'f': 1}
+        assert '_sq_counts' not in sq.schema.tables()
+        sq.read_iter('g', ({'a': i} for i in range(3)))
+        sq.flush()
+        sq.db.execute("PRAGMA query_only = 1")
+        assert sq.counts() == {'f': 1, 'g': 3}
+
+
+def test_schema_cache(tmp_path):
+    db_path = str(tmp_path / 'test.sqlite')
+    with Sq(db_path, replace=True) as sq:
+        sq.writerow('tab1', {'a': 1, 'b': 2})
+        sq.flush()
+        version = sq.schema.version
+
+        sq.writerow('tab1', {'a': 3, 'b': 4})
+        sq.flush()
+        assert sq.schema.version == version
+
+        # DDL from another connection
+        with Sq(db_path, append=True) as other:
+            other.add_new_column('tab1', 'c')
+            other.execute("CREATE INDEX tab1_a ON tab1 (a)")
+        sq.writerow('tab1', {'a': 5, 'c': 6})
+        sq.flush()
+        assert sq.table_columns('tab1') == ['a', 'b', 'c']
+        assert sq.table_indexes('tab1') == ['tab1_a']
+        sq.writerow('tab1', {'a': 7, 'c': 8})
+
+        sq.rename_columns('tab1', {'b': 'bb'})
+        sq.writerow('tab1', {'a': 9, 'bb': 10})
+        assert list(sq.iter_table('tab1'))[-1] == {'a': '9', 'bb': '10',
+                                                   'c': None}
+        assert sq.detailed_header('tab1')['bb']['col_type'] == 'TEXT'
+
+        sq.rename_table('tab1', 'tab2')
+        sq.writerow('tab2', {'a': 11})
+        assert sq.counts() == {'tab2': 6}
+
+        sq.drop('tab2')
+        sq.writerow('tab2', {'x': 1})
+        assert list(sq.iter_table('tab2')) == [{'x': '1'}]
+
+
+def test_export(tmp_path):
+    rows = [{'a': str(i), 'b': f"b,{i}"} for i in range(100)]
+    with Sq(str(tmp_path / 'db.sqlite'), silent=True) as sq:
+        sq.read_iter('x', rows)
+        sq.writerow('y', {'raw': b'\x00\x01'})
+
+        assert sq.to_csv('x', tmp_path / 'x.csv') == 100
+        with open(tmp_path / 'x.csv', newline='') as f:
+            assert list(csv.DictReader(f)) == rows
+
+        assert sq.to_csv("SELECT a FROM x WHERE rowid <= 10",
+                         tmp_path / 'q.csv.gz') == 10
+        with gzip.open(tmp_path / 'q.csv.gz', 'rt') as f:
+            assert f.read().split() == ['a'] + [str(i) for i in range(10)]
+
+        assert sq.to_jsonl('x', tmp_path / 'x.jsonl', parts=3) == 100
+        exported = list()
+        for i in range(3):
+            with open(tmp_path / f'x-{i:05d}.jsonl') as f:
+                exported.extend(json.loads(line) for line in f)
+        assert exported == rows
+
+        sq.to_jsonl('y', tmp_path / 'y.jsonl')
+        assert (tmp_path / 'y.jsonl').read_text() == '{"raw": "AAE="}\n'
+        sq.to_csv('y', tmp_path / 'y.csv')
+        assert (tmp_path / 'y.csv').read_text() == 'raw\nAAE=\n'
+
+    # read-only: an untracked table is not counted for the progress bar
+    with Sq(str(tmp_path / 'db.sqlite'), append=True) as sq:
+        sq.db.execute("CREATE TABLE raw (a)")
+        sq.db.execute("INSERT INTO raw VALUES (1)")
+        sq.db.commit()
+        assert sq.to_csv('raw', tmp_path / 'raw.csv') == 1
+        assert 'raw' not in sq._maintained_counts()
+
+
+def test_read_jsonl(tmp_path):
+    msgs = [
+        {'id': 1, 'meta': {'src': 'a', 'tags': ['x', 'y']}},
+        {'id': 2, 'meta': {'src': 'b', 'geo': {'lat': 1.5}}},
+        {'id': 3, 'extra': None},
+    ]
+    path = tmp_path / 'msgs.jsonl'
+    path.write_text('\n'.join(json.dumps(m) for m in msgs) + '\n\n')
+
+    with Sq(':memory:', silent=True) as sq:
+        sq.read_jsonl('msgs', str(path), batch_size=2)
+        assert sq.table_columns('msgs') == [
+            'id', 'meta.src', 'meta.tags', 'meta.geo.lat', 'extra']
+        rows = list(sq.iter_table('msgs'))
+        assert rows[0] == {'id': '1', 'meta.src': 'a',
+                           'meta.tags': '["x", "y"]',
+                           'meta.geo.lat': None, 'extra': None}
+        assert rows[1]['meta.geo.lat'] == '1.5'
+
+        sq.read_jsonl('nested', str(path), flatten='_', max_depth=2)
+        assert list(sq.iter_table('nested'))[1]['meta_geo'] == '{"lat": 1.5}'
+
+        # replaced unless append, like read_csv
+        sq.read_jsonl('msgs', str(path), batch_size=2)
+        assert sq.counts('msgs') == 3
+        sq.read_jsonl('msgs', str(path), append=True)
+        assert sq.counts('msgs') == 6
+
+        # malformed lines are not rows, even if the batch joins up
+        for text in ['{"a": 1}\n{"a": 2},{"a": 3}\n',
+                     '{"a": 1},{"b": ["x"\n"y"]}\n']:
+            path.write_text(text)
+            try:
+                sq.read_jsonl('bad', str(path))
+            except json.JSONDecodeError:
+                pass
+            else:
+                assert False, 'malformed line accepted'
+
+
+def test_read_csv_compressed(tmp_path):
+    text = 'a,b\n' + ''.join(f'{i},"x\n{i}"\n' for i in range(1000))
+    expected = [{'a': str(i), 'b': f'x\n{i}'} for i in range(1000)]
+    files = {
+        'x.csv': text.encode(),
+        'x.csv.gz': gzip.compress(text[:50].encode())
+        + gzip.compress(text[50:].encode()),
+        'x.bz2': bz2.compress(text.encode()),
+        'x.data': lzma.compress(text.encode()),
+    }
+    with Sq(':memory:') as sq:
+        for name, data in files.items():
+            (tmp_path / name).write_bytes(data)
+            sq.read_csv('t', str(tmp_path / name))
+            assert list(sq.iter_table('t')) == expected, name
+
+        # caller's file objects are read but left open
+        with open(tmp_path / 'x.bz2', 'rb') as f:
+            sq.read_csv('t', f)
+            assert not f.closed
+        assert list(sq.iter_table('t')) == expected
+        with open(tmp_path / 'x.csv', newline='') as f:
+            sq.read_csv('t', f)
+            assert not f.closed
+        assert list(sq.iter_table('t')) == expected
+
+        # NUL padding after a gzip member, as gzip.open allows
+        (tmp_path / 'pad.gz').write_bytes(files['x.csv.gz'] + b'\x00' * 100)
+        sq.read_csv('t', str(tmp_path / 'pad.gz'))
+        assert list(sq.iter_table('t')) == expected
+
+    with open_input(str(tmp_path / 'x.csv.gz')) as f:
+        assert f.read() == text
+
+    # truncated archives raise instead of loading a partial table
+    for name, data in files.items():
+        if name == 'x.csv':
+            continue
+        (tmp_path / name).write_bytes(data[:len(data) // 2])
+        try:
+            with open_input(str(tmp_path / name)) as f:
+                f.read()
+        except EOFError:
+            pass
+        else:
+            assert False, f'truncated {name} accepted'
+
+    # closing early stops the decompressing thread blocked on a full queue
+    (tmp_path / 'big.gz').write_bytes(gzip.compress(text.encode() * 200))
+    reader = _DecompressReader(open(tmp_path / 'big.gz', 'rb'),
+                               lambda: zlib.decompressobj(wbits=31),
+                               chunk_size=64, queue_size=1)
+    reader.read(10)
+    reader.close()
+    assert not reader._thread.is_alive()
+
+
+def test_read_csv_resume(tmp_path):
+    text = 'a,b\n' + ''.join(f'{i},"x\n{i}"\n' for i in range(100))
+    expected = [{'a': str(i), 'b': f'x\n{i}'} for i in range(100)]
+    (tmp_path / 'x.csv').write_text(text)
+    (tmp_path / 'x.csv.gz').write_bytes(gzip.compress(text.encode()))
+
+    def _crash_at(n):
+        def _converter(row):
+            if row[0] == str(n):
+                raise KeyboardInterrupt()
+        return _converter
+
+    db = str(tmp_path / 'db.sqlite')
+    for name in ['x.csv', 'x.csv.gz']:
+        path = str(tmp_path / name)
+        with Sq(db, bulk_limit=10, silent=True) as sq:
+            try:
+                sq.read_csv('t', path, checkpoint=True,
+                            converter=_crash_at(55))
+            except KeyboardInterrupt:
+                pass
+            # rows buffered before the error are committed with their
+            # checkpoint
+            assert sq.checkpoint('t')['rows'] == 55
+            assert sq.counts('t') == 55
+
+        with Sq(db, bulk_limit=10, silent=True) as sq:
+            sq.read_csv('t', path, resume=True)
+            assert list(sq.iter_table('t')) == expected, name
+            sq.read_csv('t', path, resume=True)
+            assert sq.counts('t') == 100
+
+    with Sq(db, bulk_limit=10, silent=True) as sq:
+        sq.read_iter('i', ({'a': i} for i in range(25)), checkpoint=True)
+        sq.read_iter('i', ({'a': i} for i in range(40)), resume=True,
+                     source='i')
+        assert [int(row['a']) for row in sq.iter_table('i')] == \
+            list(range(40))
+
+
+def test_staging(tmp_path):
+    path = tmp_path / 'db.sqlite'
+    with Sq(str(path), staging='memory', silent=True) as sq:
+        sq.read_iter('x', ({'a': i} for i in range(100)))
+        sq.flush()
+        assert not path.exists()
+        sq.snapshot(tmp_path / 'copy.sqlite')
+    assert Sq(str(path)).counts() == {'x': 100}
+    assert Sq(str(tmp_path / 'copy.sqlite')).counts() == {'x': 100}
+
+    # staging in a directory, existing data is loaded, periodic snapshots
+    with Sq(str(path), append=True, staging=str(tmp_path), silent=True,
+            snapshot_interval=0) as sq:
+        sq.writerow('x', {'a': 100})
+        sq.flush()
+        assert Sq(str(path)).counts() == {'x': 101}
+    assert Sq(str(path)).counts() == {'x': 101}
+    assert sorted(p.name for p in tmp_path.iterdir()) == [
+        'copy.sqlite', 'db.sqlite']
+
+
+def test_delete_where_and_reclaim(tmp_path):
+    path = str(tmp_path / 'db.sqlite')
+    with Sq(path, auto_vacuum='INCREMENTAL', silent=True) as sq:
+        sq.read_iter('x', ({'a': i, 'pad': 'x' * 500} for i in range(2000)))
+        sq.flush()
+
+        assert sq.delete_where('x', "CAST(a AS INT) % ? != 0", params=(4,),
+                               batch=100) == 1500
+        assert sq.counts('x') == 500
+        assert all(int(row['a']) % 4 == 0 for row in sq.iter_table('x'))
+
+        free = sq.db.execute('PRAGMA freelist_count').fetchone()[0]
+        assert free > 10
+        assert sq.reclaim(10) == 10
+        assert sq.reclaim() == free - 10
+        assert sq.db.execute('PRAGMA freelist_count').fetchone()[0] == 0
+
+    # an existing file is converted
+    with Sq(str(tmp_path / 'db2.sqlite')) as sq:
+        sq.writerow('x', {'a': 1})
+    with Sq(str(tmp_path / 'db2.sqlite'), auto_vacuum='incremental') as sq:
+        assert sq.db.execute('PRAGMA auto_vacuum').fetchone()[0] == 2
+        assert sq.counts('x') == 1
+
+
+def test_merge_from(tmp_path):
+    paths = [str(tmp_path / f'w{i}.sqlite') for i in range(3)]
+    for i, path in enumerate(paths):
+        with Sq(path) as sq:
+            sq.read_iter('x', ({'a': i, f'c{i}': j} for j in range(10)))
+            sq.writerow('only', {'w': i})
+
+    target = str(tmp_path / 'all.sqlite')
+    with Sq(target, silent=True) as sq:
+        sq.read_iter('x', ({'a': 'target'} for _ in range(5)))
+        assert sq.merge_from(paths) == {'x': 30, 'only': 3}
+        assert sq.table_columns('x') == ['a', 'c0', 'c1', 'c2']
+        assert sq.counts() == {'x': 35, 'only': 3}
+        rows = list(sq.iter_table('x', where_clause="a = '2'"))
+        assert rows[3] == {'a': '2', 'c0': None, 'c1': None, 'c2': '3'}
+
+        assert sq.merge_from(paths[:1], dedup=True) == {'x': 0, 'only': 0}
+        # duplicates within the source are all copied
+        with Sq(str(tmp_path / 'ev.sqlite')) as other:
+            other.read_iter('ev', ({'ev': 'click'} for _ in range(3)))
+        assert sq.merge_from(str(tmp_path / 'ev.sqlite'),
+                             dedup=True) == {'ev': 3}
+        assert sq.merge_from(str(tmp_path / 'ev.sqlite'),
+                             dedup=True) == {'ev': 0}
+        sq.writerow('only', {'w': 3})
+        assert sq.counts('only') == 4
+
+        with Sq(paths[2], append=True) as other:
+            other.writerow('x', {'new': 1})
+        try:
+            sq.merge_from(paths[2], on_schema_mismatch='error')
+            assert False, 'ValueError expected'
+        except ValueError:
+            pass
+        sq.merge_from(paths[2], tables=['x'], on_schema_mismatch='ignore')
+        assert sq.table_columns('x') == ['a', 'c0', 'c1', 'c2']
+
+        # a failing file is rolled back as a whole
+        bad = str(tmp_path / 'bad.sqlite')
+        with Sq(bad) as other:
+            other.writerow('only', {'w': 9})
+            other.writerow('x', {'new': 1})
+        before = sq.counts()
+        try:
+            sq.merge_from(bad, on_schema_mismatch='error')
+            assert False, 'ValueError expected'
+        except ValueError:
+            pass
+        assert sq.counts() == before
+        assert sq.counts(refresh=True) == before
+
+        # REPLACE: rowcount includes the replaced rows
+        with Sq(str(tmp_path / 'u.sqlite')) as other:
+            other.execute("CREATE TABLE u (k INTEGER PRIMARY KEY, v)")
+            other.execute("INSERT INTO u VALUES (1, 'a'), (2, 'b')")
+        for _ in range(2):
+            sq.merge_from(str(tmp_path / 'u.sqlite'), on_conflict='replace')
+        assert sq.counts('u') == 2
+        try:
+            sq.merge_from(paths[0], on_conflict='IGNORE INTO x; --')
+            assert False, 'ValueError expected'
+        except ValueError:
+            pass
+
+
+def test_materialize():
+    with Sq(':memory:', silent=True) as sq:
+        def _append(start, stop):
+            for i in range(start, stop):
+                sq.writerow('src', {'g': i % 3, 'v': i})
+            sq.flush()
+
+        sq.create_table('src', header=['g', 'v'],
+                        dtypes={'g': int, 'v': int})
+        _append(0, 10)
+        filtered = "SELECT g, v FROM src WHERE v % 2 = 0"
+        grouped = "SELECT g, COUNT(*) AS n, SUM(v) AS s, MAX(v) AS m " \
+                  "FROM src GROUP BY g"
+        aggregates = {'n': 'count', 's': 'sum', 'm': 'max'}
+
+        def _check():
+            assert list(sq.iter_table('even')) == list(sq.iter_query(filtered))
+            assert sorted(sq.iter_table('grp'), key=lambda r: r['g']) == \
+                list(sq.iter_query(grouped + " ORDER BY g"))
+
+        assert sq.materialize('even', filtered, source='src') == 5
+        assert sq.materialize('grp', grouped, source='src', key=['g'],
+                              aggregates=aggregates) == 3
+        _check()
+
+        _append(10, 17)
+        assert sq.materialize('even', filtered, source='src') == 4
+        assert sq.materialize('grp', grouped, source='src', key=['g'],
+                              aggregates=aggregates) == 0
+        _check()
+        assert sq.materialize('even', filtered, source='src') == 0
+        assert sq.counts('even') == 9
+
+        # a shrunk source triggers a full rebuild
+        sq.delete_where('src', 'v > 12')
+        assert sq.materialize('even', filtered, source='src') == 7
+        sq.writerow('src', {'g': 5, 'v': 100})
+        assert sq.materialize('even', filtered, source='src') == 1
+        sq.materialize('grp', grouped, source='src', key=['g'],
+                       aggregates=aggregates)
+        _check()
+        assert 'src' in sq.tables() and \
+            sq.db.execute("SELECT COUNT(1) FROM src").fetchone()[0] == 14
+
+        # AVG can't be merged incrementally
+        try:
+            sq.materialize('avg', "SELECT g, SUM(v) s, AVG(v) a FROM src "
+                           "GROUP BY g", source='src', key=['g'],
+                           aggregates={'s': 'sum'})
+            assert False, 'ValueError expected'
+        except ValueError:
+            pass
+        assert 'avg' not in sq.tables()
+
+        # unkeyed aggregates are rebuilt, not appended to
+        total = "SELECT COUNT(*) AS n FROM src"
+        sq.materialize('total', total, source='src')
+        sq.writerow('src', {'g': 1, 'v': 1})
+        sq.materialize('total', total, source='src')
+        assert list(sq.iter_table('total')) == list(sq.iter_query(total))
+        try:
+            sq.materialize('total', total, source='src', mode='ful')
+            assert False, 'ValueError expected'
+        except ValueError:
+            pass
+
+
+def test_remap_values():
+    with Sq(':memory:') as sq:
+        values = ["o'neil", 'NY', 'ny', 'LA', None, 'x NY y', "it's ny"]
+        sq.read_iter('t', ({'city': v} for v in values))
+
+        mapping = {'NY': 'New York', 'ny': 'New York', "o'neil": 'O"Neil',
+                   'LA': 'LA', 'unused': 'x'}
+        assert sq.remap_values('t', 'city', mapping) == 3
+        assert [row['city'] for row in sq.iter_table('t')] == [
+            'O"Neil', 'New York', 'New York', 'LA', None, 'x NY y',
+            "it's ny"]
+
+        assert sq.remap_values('t', 'city', {'ny': 'NYC', "'s": ' is',
+                                             'New York': 'NYC'},
+                               mode='substring') == 3
+        assert [row['city'] for row in sq.iter_table('t')] == [
+            'O"Neil', 'NYC', 'NYC', 'LA', None, 'x NY y', "it is NYC"]
+
+        sq.replace_value('t', 'city', "O\"Neil", "o'neil")
+        assert sq.select_random_row('t', where="rowid = 1")['city'] == \
+            "o'neil"
+
+
+def test_fts():
+    texts = ['the quick brown fox', 'lazy dog sleeps', 'quick quick dog',
+             'nothing here']
+    with Sq(':memory:', bulk_limit=2) as sq:
+        sq.read_iter('msgs', ({'id': i, 'text': t}
+                              for i, t in enumerate(texts)))
+        sq.read_iter('log', ({'id': i, 'text': t}
+                             for i, t in enumerate(texts)))
+
+        sq.create_fts('msgs', ['text'])
+        sq.create_fts('log', ['text'], tokenizer='porter unicode61',
+                      sync='flush')
+        assert [r['id'] for r in sq.search('msgs', 'quick')] == ['2', '0']
+        assert len(sq.search('msgs', 'dog', limit=1)) == 1
+        assert sq.search('msgs', 'brown OR nothing') == [
+            {'id': '3', 'text': 'nothing here'},
+            {'id': '0', 'text': 'the quick brown fox'}]
+
+        sq.writerow('msgs', {'id': 4, 'text': 'fox and dog'})
+        sq.writerow('log', {'id': 4, 'text': 'dogs sleeping'})
+        sq.delete_where('msgs', "id = '2'")
+        assert sorted(r['id'] for r in sq.search('msgs', 'dog')) == ['1', '4']
+        assert sorted(r['id'] for r in sq.search('log', 'sleep')) == ['1', '4']
+        assert sq.tables() == ['msgs', 'log']
+
+        # renaming rebuilds the index, keeping tokenizer and sync mode
+        sq.rename_table('log', 'log2')
+        sq.writerow('log2', {'id': 5, 'text': 'sleep well'})
+        assert sorted(r['id'] for r in sq.search('log2', 'sleep')) == \
+            ['1', '4', '5']
+        sq.rename_table('msgs', 'm2')
+        sq.execute("DELETE FROM m2 WHERE id = '4'")
+        assert [r['id'] for r in sq.search('m2', 'dog')] == ['1']
+        assert not [t for t in sq.schema.tables() if t.endswith('_msgs')]
+        assert [r[0] for r in sq.db.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'trigger' "
+            "ORDER BY name")] == [f'_sq_fts_m2_{op}' for op in
+                                  ('ad', 'ai', 'au')]
+
+        sq.drop('m2')
+        assert not [t for t in sq.schema.tables() if 'fts_m2' in t]
+
+
+def test_profile(tmp_path):
+    path = str(tmp_path / 'db.sqlite')
+    with Sq(path) as sq:
+        sq.create_table('t', header=['n', 'txt', 'mixed'],
+                        dtypes={'n': int})
+        for i in range(5000):
+            sq.writerow('t', {'n': i, 'txt': str(i % 7) if i % 10 else None,
+                              'mixed': i if i % 2 else f"s{i % 1000}"})
+        sq.flush()
+
+        profile = sq.profile('t')
+        assert profile['n']['min'] == 0 and profile['n']['max'] == 4999
+        assert profile['n']['nulls'] == 0
+        assert abs(profile['n']['distinct'] - 5000) < 5000 * 0.05
+        assert profile['n']['inferred_type'] == 'INTEGER'
+
+        assert profile['txt']['nulls'] == 500
+        assert profile['txt']['distinct'] == 7
+        assert profile['txt']['distinct_exact']
+        assert profile['txt']['types'] == {'TEXT': 4500}
+        assert profile['txt']['inferred_type'] == 'INTEGER'
+        assert profile['txt']['top'][0][1] >= 4500 // 7
+
+        assert profile['mixed']['inferred_type'] == 'TEXT'
+        assert profile['mixed']['min'] == '1' and \
+            profile['mixed']['max'] == 's998'
+        assert sq.profile('t') is profile
+
+        parallel = sq.profile('t', parts=3)
+        assert parallel is profile
+        sq.writerow('t', {'n': -1})
+        parallel = sq.profile('t', parts=3)
+        assert parallel['n']['min'] == -1
+        assert parallel['n']['count'] == 5001
+        assert parallel['txt'] == dict(profile['txt'], count=5001,
+                                       nulls=501)
+
+
+def test_stats():
+    events = list()
+    with Sq(':memory:', bulk_limit=10) as sq:
+        sq.metrics.add_callback(lambda name, value: events.append(name))
+        for i in range(25):
+            sq.writerow('t', {'a': i})
+        sq.writerow('t', {'a': 25, 'b': 1})
+        sq.update_field('t', 'a', 0, keys={'rowid': 1})
+
+        stats = sq.stats()
+        # 11 + 11 rows over bulk_limit, 3 before adding column b
+        assert stats['counters']['rows_flushed'] == 25
+        assert stats['counters']['flushes'] == 3
+        # create table, add column (not the internal _sq_counts)
+        assert stats['counters']['schema_changes'] == 2
+        sq.db.execute("CREATE TABLE _sq_internal (a)")
+        sq.schema.check()
+        assert sq.stats()['counters']['schema_changes'] == 2
+        assert stats['rows_buffered'] == 1
+        assert stats['updates_buffered'] == 1
+        assert stats['timings']['executemany']['count'] == 3
+        assert stats['timings']['commit']['p99'] >= \
+            stats['timings']['commit']['min']
+        assert stats['db_bytes'] > 0
+
+        sq.flush(finalize=True)
+        stats = sq.stats()
+        assert stats['counters']['rows_flushed'] == 26
+        assert stats['counters']['update_batches'] == 1
+        assert events.count('rows_flushed') == 4
+
+
+def test_bench(tmp_path):
+    from sqlfile import bench
+    results = bench.run(str(tmp_path / 'bench.sqlite'), rows=200,
+                        names=['narrow_int', 'sparse_drift'])
+    assert results['narrow_int.writerow']['rows'] == 200
+    assert 'sparse_drift.read_csv' in results
+    assert 'change_column_type' in results
+    assert 'narrow_int.counts_maintained' in results
+    assert not (tmp_path / 'bench.sqlite').exists()
+
+    # never runs on (and removes) an existing database
+    (tmp_path / 'keep.sqlite').write_bytes(b'')
+    try:
+        bench.run(str(tmp_path / 'keep.sqlite'), rows=10)
+        assert False, 'IOError expected'
+    except IOError:
+        pass
+    assert (tmp_path / 'keep.sqlite').exists()
+
+    baseline = {name: dict(r, rows_per_s=r['rows_per_s'] * 10)
+                for name, r in results.items()}
+    ratios, regressions = bench.compare(results, baseline)
+    assert set(regressions) == set(results)
+    ratios, regressions = bench.compare(results, results)
+    assert not regressions and ratios['update_field'] == 1
+
+
 if __name__ == '__main__':
     logging.basicConfig(level='INFO')